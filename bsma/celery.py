@@ -18,6 +18,9 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 # Load task modules from all registered Django app configs.
 app.autodiscover_tasks()
 
+# Connect the task metrics signal handlers.
+from . import task_metrics  # noqa: E402,F401
+
 
 @app.task(bind=True)
 def debug_task(self):
@@ -0,0 +1,272 @@
+"""
+Metrics in the Prometheus text format.
+
+Every process counts into its own ``REGISTRY`` and ``flush`` dumps it to
+``METRICS_TEXTFILE_DIR/.process-<pid>.json`` every few seconds. ``render``
+sums the dumps of all gunicorn workers, so a scrape sees the whole server
+whichever worker answers it. Background jobs add their metrics to files in
+the same directory with ``write_textfile`` and ``render`` appends those files.
+"""
+from bisect import bisect_left
+import fcntl
+import json
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Seconds between dumps of a process registry, the lag of /metrics behind the workers.
+FLUSH_INTERVAL = 5
+
+
+def format_labels(labelnames, values, **extra):
+    pairs = [*zip(labelnames, values), *extra.items()]
+    if not pairs:
+        return ''
+    escaped = (str(value).replace('\\', r'\\').replace('"', r'\"').replace('\n', r'\n') for _, value in pairs)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + '}'
+
+
+def format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def dump(self):
+        with self._lock:
+            values = [[list(key), value] for key, value in self._values.items()]
+        return {'type': self.type, 'documentation': self.documentation, 'labelnames': list(self.labelnames),
+                'values': values}
+
+    def merge(self, values):
+        with self._lock:
+            for key, value in values:
+                key = tuple(key)
+                self._values[key] = self._merge_value(self._values.get(key), value)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self.samples(key, value))
+        return lines
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _merge_value(self, current, value):
+        return (current or 0) + value
+
+    def samples(self, key, value):
+        yield f'{self.name}{format_labels(self.labelnames, key)} {format_value(value)}'
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def _merge_value(self, current, value):
+        return value
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                # Counts per bucket, the last one is +Inf, then the sum.
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def dump(self):
+        return dict(super(Histogram, self).dump(), buckets=list(self.buckets))
+
+    def _merge_value(self, current, value):
+        if current is None:
+            return list(value)
+        return [a + b for a, b in zip(current, value)]
+
+    def samples(self, key, counts):
+        cumulative = 0
+        for bound, count in zip((*self.buckets, '+Inf'), counts):
+            cumulative += count
+            le = bound if bound == '+Inf' else format_value(float(bound))
+            yield f'{self.name}_bucket{format_labels(self.labelnames, key, le=le)} {cumulative}'
+        yield f'{self.name}_sum{format_labels(self.labelnames, key)} {format_value(float(counts[-1]))}'
+        yield f'{self.name}_count{format_labels(self.labelnames, key)} {cumulative}'
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, *args, **kwargs)
+            return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter, name, documentation, labelnames)
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge, name, documentation, labelnames)
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, documentation, labelnames, buckets)
+
+    def dump(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.dump() for metric in metrics}
+
+    def merge(self, dumped):
+        """Add values of another registry's ``dump()``: counters and histograms are summed, gauges replaced."""
+        types = {'counter': self.counter, 'gauge': self.gauge, 'histogram': self.histogram}
+        for name, data in dumped.items():
+            args = [name, data['documentation'], data['labelnames']]
+            if 'buckets' in data:
+                args.append(data['buckets'])
+            types[data['type']](*args).merge(data['values'])
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = [line for metric in metrics for line in metric.render()]
+        return '\n'.join(lines) + '\n' if lines else ''
+
+
+REGISTRY = Registry()
+
+
+def replace_file(path, content):
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.metrics-')
+    with os.fdopen(fd, 'w') as tmp:
+        tmp.write(content)
+    os.chmod(tmp_path, 0o644)
+    os.replace(tmp_path, path)
+
+
+def write_textfile(registry, name):
+    """
+    Add the values of ``registry`` to ``METRICS_TEXTFILE_DIR/<name>.prom``.
+
+    The file is shared by all processes that write ``name``: the merged values
+    are kept next to it in ``.<name>.json`` and updated under a file lock.
+    """
+    directory = settings.METRICS_TEXTFILE_DIR
+    if not directory:
+        return
+    os.makedirs(directory, exist_ok=True)
+    state_path = os.path.join(directory, f'.{name}.json')
+    with open(os.path.join(directory, f'.{name}.lock'), 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        merged = Registry()
+        try:
+            with open(state_path) as state:
+                merged.merge(json.load(state))
+        except FileNotFoundError:
+            pass
+        merged.merge(registry.dump())
+        replace_file(state_path, json.dumps(merged.dump()))
+        replace_file(os.path.join(directory, f'{name}.prom'), merged.render())
+
+
+_flush = {'pid': None, 'at': 0}
+_flush_lock = threading.Lock()
+
+
+def process_path(directory, pid):
+    return os.path.join(directory, f'.process-{pid}.json')
+
+
+def flush(force=False):
+    """
+    Dump ``REGISTRY`` of this process for ``render``, at most every ``FLUSH_INTERVAL``
+    seconds unless ``force``.
+
+    Dumps of exited workers stay, so counters summed over the processes never
+    go down. A new process with the pid of an exited one continues its values.
+    """
+    directory = settings.METRICS_TEXTFILE_DIR
+    if not directory:
+        return
+    now = time.monotonic()
+    with _flush_lock:
+        pid = os.getpid()
+        if not force and _flush['pid'] == pid and now - _flush['at'] < FLUSH_INTERVAL:
+            return
+        os.makedirs(directory, exist_ok=True)
+        path = process_path(directory, pid)
+        if _flush['pid'] != pid:
+            try:
+                with open(path) as f:
+                    REGISTRY.merge(json.load(f))
+            except (FileNotFoundError, ValueError):
+                pass
+        _flush['pid'], _flush['at'] = pid, now
+        replace_file(path, json.dumps(REGISTRY.dump()))
+
+
+def render():
+    """
+    Metrics of all processes of the web app followed by the ``*.prom`` files
+    of ``METRICS_TEXTFILE_DIR``.
+    """
+    directory = settings.METRICS_TEXTFILE_DIR
+    if not directory:
+        return REGISTRY.render()
+
+    flush(force=True)
+    merged = Registry()
+    names = sorted(os.listdir(directory))
+    for name in names:
+        if name.startswith('.process-') and name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    merged.merge(json.load(f))
+            except (FileNotFoundError, ValueError):
+                # Файл процесса как раз заменяется
+                continue
+    text = merged.render()
+    for name in names:
+        if name.endswith('.prom'):
+            with open(os.path.join(directory, name)) as f:
+                text += f.read()
+    return text
@@ -0,0 +1,87 @@
+from contextlib import ExitStack
+import logging
+import time
+
+from django.conf import settings
+from django.db import connections
+
+from .metrics import REGISTRY, flush
+
+logger = logging.getLogger(__name__)
+
+# Longest part of the slowest query written to the slow request log, bulk
+# statements with thousands of parameters would flood it otherwise.
+SLOW_SQL_MAX_LENGTH = 1000
+
+REQUEST_DURATION = REGISTRY.histogram(
+    'bsma_request_duration_seconds', 'Time to build the response of a request.', ['view', 'method', 'status'])
+REQUEST_QUERIES = REGISTRY.histogram(
+    'bsma_request_db_queries', 'Database queries per request.', ['view'],
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500))
+REQUEST_DB_DURATION = REGISTRY.histogram(
+    'bsma_request_db_duration_seconds', 'Time spent in database queries per request.', ['view'])
+
+
+class QueryStats:
+    """``execute_wrapper`` that counts queries and their time and keeps the slowest one."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0
+        self.slowest = (0, None)
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.count += 1
+            self.duration += duration
+            if duration > self.slowest[0]:
+                self.slowest = (duration, sql)
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, query count and database time of every request into
+    ``bsma.metrics`` histograms per view and returns them in ``Server-Timing``.
+    The histograms are flushed for ``/metrics`` to sum them over all workers.
+
+    Requests slower than ``SLOW_REQUEST_SECONDS`` are logged with their slowest
+    query. Streaming responses are measured until the first byte.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for connection in connections.all():
+                stack.enter_context(connection.execute_wrapper(stats))
+            response = self.get_response(request)
+        duration = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = match.view_name if match else 'unmatched'
+        REQUEST_DURATION.observe(duration, view=view, method=request.method, status=f'{response.status_code // 100}xx')
+        REQUEST_QUERIES.observe(stats.count, view=view)
+        REQUEST_DB_DURATION.observe(stats.duration, view=view)
+        try:
+            flush()
+        except OSError as exc:
+            logger.warning('Could not write request metrics: %s', exc)
+
+        response['Server-Timing'] = (f'app;dur={duration * 1000:.1f}, '
+                                     f'db;dur={stats.duration * 1000:.1f};desc="{stats.count} queries"')
+
+        if duration > settings.SLOW_REQUEST_SECONDS:
+            slowest_duration, slowest_sql = stats.slowest
+            if slowest_sql and len(slowest_sql) > SLOW_SQL_MAX_LENGTH:
+                slowest_sql = f'{slowest_sql[:SLOW_SQL_MAX_LENGTH]}... ({len(slowest_sql)} characters)'
+            logger.warning('Slow request %s %s (%s): %.0f ms, %d queries, %.0f ms in database, slowest %.0f ms: %s',
+                           request.method, request.path, view, duration * 1000, stats.count,
+                           stats.duration * 1000, slowest_duration * 1000, slowest_sql)
+        return response
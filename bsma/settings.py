@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -46,6 +47,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'bsma.middleware.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     "corsheaders.middleware.CorsMiddleware",
@@ -133,6 +135,17 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Backend of products.views.upload_media. 'products.storage.ContentAddressedStorage' stores
+# identical files once and keeps a manifest of names per article.
+MEDIA_STORAGE = 'products.storage.DirectoryStorage'
+
+# Largest file accepted by the resumable upload API, in bytes.
+MEDIA_UPLOAD_MAX_SIZE = 4 * 1024 ** 3
+# Unfinished uploads of one user, and seconds without a chunk before an unfinished upload
+# is removed by products.tasks.remove_expired_uploads.
+MEDIA_UPLOAD_MAX_OPEN = 20
+MEDIA_UPLOAD_EXPIRY = 60 * 60 * 24
+
 
 # Auth
 
@@ -140,6 +153,12 @@ AUTH_USER_MODEL = 'accounts.User'
 
 LOGIN_REDIRECT_URL = 'index'
 
+# Seconds the admin keeps the article date hierarchy before recounting it.
+ADMIN_DATE_HIERARCHY_CACHE_TIMEOUT = 600
+
+# Seconds a station's verified basic auth credentials are trusted without hashing the password again.
+STATION_AUTH_CACHE_TIMEOUT = 300
+
 LOGOUT_REDIRECT_URL = 'accounts:login'
 
 
@@ -148,6 +167,16 @@ LOCALE_PATHS = [
 ]
 
 
+# MAC address storage: 'row' keeps a Mac per address, 'range' keeps a MacRange per article.
+# Run `manage.py fold_macs` before switching an existing database to 'range'.
+MAC_STORAGE = 'row'
+
+# Top-level keys of Article.extra that are often filtered on. On PostgreSQL `migrate` creates
+# a GIN index for each of them and the API finds candidates by containment before matching
+# the value exactly.
+ARTICLE_EXTRA_INDEXED_KEYS = []
+
+
 REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 100,
@@ -155,6 +184,35 @@ REST_FRAMEWORK = {
 }
 
 
+# Request metrics, see bsma.middleware.RequestMetricsMiddleware
+SLOW_REQUEST_SECONDS = 1  # requests slower than this are logged with their slowest query
+# Scrapers send it as `Authorization: Bearer <token>`, empty lets only staff users read /metrics.
+METRICS_TOKEN = ''
+# Gunicorn workers dump their request metrics there for /metrics to sum them, Celery workers
+# write celery.prom there. Must be a directory shared by gunicorn and the Celery workers.
+METRICS_TEXTFILE_DIR = os.path.join(tempfile.gettempdir(), 'bsma-metrics')
+
+
+# RosStat activation checks, see products.rosstat.RosstatChecker
+ROS_PRODUCTS = [1]  # ids of products whose articles are checked
+ROS_RECHECK_INTERVAL = 60 * 60 * 24  # seconds after the first unsuccessful check, doubled after every next one
+ROS_RECHECK_MAX_INTERVAL = 60 * 60 * 24 * 64
+ROS_RATE = 1  # requests started per second, shared by all chunk tasks on all workers
+ROS_CONCURRENCY = 4  # requests in flight per chunk task
+ROS_BATCH_SIZE = 100  # articles per bulk update
+ROS_RETRIES = 3
+ROS_BACKOFF = 1  # seconds, doubled on every retry
+ROS_TIMEOUT = 30
+ROS_CHUNK_SIZE = 1000  # articles per check_rosstat_chunk task
+ROS_CHUNK_MAX_ATTEMPTS = 3  # starts of a chunk before it is given up
+ROS_RUN_MAX_AGE = 60 * 60 * 20  # seconds after which an unfinished run is given up for a new one
+
+# Days of daily statistics recomputed by products.tasks.rollup_stats every 15 minutes.
+# Older days are recomputed only when their articles are modified, `manage.py rollup_stats`
+# recomputes everything.
+STATS_ROLLUP_DAYS = 7
+
+
 try:
     from .local_settings import *
 except ImportError:
@@ -0,0 +1,79 @@
+"""
+Celery task metrics collected through signals.
+
+Every task run gets a ``TaskStats`` registry that the task fills through
+``task_stats()``. When the run ends its duration, outcome and item count
+are added and everything is merged into ``METRICS_TEXTFILE_DIR/celery.prom``,
+which ``/metrics`` appends to the web app metrics.
+"""
+import logging
+import threading
+import time
+
+from celery import signals
+
+from .metrics import Registry, write_textfile
+
+logger = logging.getLogger(__name__)
+
+TASK_DURATION_BUCKETS = (0.1, 0.5, 1, 5, 10, 30, 60, 300, 600, 1800, 3600, 7200, 14400)
+
+_local = threading.local()
+
+
+class TaskStats(Registry):
+    """Metrics of one task run."""
+
+    def __init__(self, task_name=None):
+        super(TaskStats, self).__init__()
+        self.task_name = task_name
+        self.started = time.monotonic()
+        self.items = 0
+        self._items_lock = threading.Lock()
+
+    def add_items(self, count):
+        """Count processed items, e.g. checked articles, for ``celery_task_items_total`` and items per second."""
+        with self._items_lock:
+            self.items += count
+
+
+def task_stats():
+    """``TaskStats`` of the task running in this thread, a throwaway one outside of tasks."""
+    stats = getattr(_local, 'stats', None)
+    return stats if stats is not None else TaskStats()
+
+
+@signals.task_prerun.connect
+def start_task_stats(task=None, **kwargs):
+    _local.stats = TaskStats(task.name)
+
+
+@signals.task_failure.connect
+def count_task_failure(sender=None, exception=None, **kwargs):
+    stats = getattr(_local, 'stats', None)
+    if stats is not None:
+        stats.counter('celery_task_failures_total', 'Task runs that raised, by exception class.',
+                      ['task', 'exception']).inc(task=sender.name, exception=type(exception).__name__)
+
+
+@signals.task_postrun.connect
+def write_task_stats(task=None, state=None, **kwargs):
+    stats = getattr(_local, 'stats', None)
+    _local.stats = None
+    if stats is None:
+        return
+
+    duration = time.monotonic() - stats.started
+    name = task.name
+    stats.histogram('celery_task_duration_seconds', 'Run time of tasks.', ['task', 'state'],
+                    TASK_DURATION_BUCKETS).observe(duration, task=name, state=state)
+    stats.counter('celery_task_items_total', 'Items processed by tasks.', ['task']).inc(stats.items, task=name)
+    if stats.items:
+        stats.gauge('celery_task_last_items_per_second', 'Items per second of the last run that processed items.',
+                    ['task']).set(stats.items / duration, task=name)
+    stats.gauge('celery_task_last_run_timestamp_seconds', 'End of the last run.', ['task']).set(time.time(), task=name)
+
+    try:
+        write_textfile(stats, 'celery')
+    except OSError as exc:
+        logger.warning('Could not write metrics of %s: %s', name, exc)
@@ -17,8 +17,11 @@ from django.contrib import admin
 from django.urls import path, include
 from django.utils.translation import gettext_lazy as _
 
+from . import views
+
 
 urlpatterns = [
+    path('metrics', views.metrics),
     path('', admin.site.urls),
     # path('admin/', admin.site.urls),
     path('api-auth/', include('rest_framework.urls', namespace='rest_framework')),
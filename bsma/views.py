@@ -0,0 +1,19 @@
+import hmac
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseForbidden
+
+from . import metrics as bsma_metrics
+
+
+def has_metrics_token(request):
+    scheme, _, token = request.META.get('HTTP_AUTHORIZATION', '').partition(' ')
+    return bool(settings.METRICS_TOKEN) and scheme.lower() == 'bearer' and hmac.compare_digest(
+        token.encode(), settings.METRICS_TOKEN.encode())
+
+
+def metrics(request):
+    """Prometheus scrape endpoint, open to staff users and requests with the ``METRICS_TOKEN`` bearer token."""
+    if not has_metrics_token(request) and not request.user.is_staff:
+        return HttpResponseForbidden()
+    return HttpResponse(bsma_metrics.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
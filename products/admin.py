@@ -1,7 +1,10 @@
 from django.contrib import admin
+from django.db import models
 from django.utils.translation import gettext_lazy as _
 
-from .models import Product, Mac, Article, Operation
+from .models import Product, Mac, MacRange, Article, Operation, ActivationRun, SERIAL_MAX
+from .lookup import find_articles
+from .pagination import EstimatedCountPaginator
 
 # Register your models here.
 
@@ -22,6 +25,12 @@ class MacAdmin(admin.ModelAdmin):
     raw_id_fields = ('article',)
 
 
+@admin.register(MacRange)
+class MacRangeAdmin(admin.ModelAdmin):
+    list_display = ['product', '__str__', 'count', 'article']
+    raw_id_fields = ('article',)
+
+
 class OperationsInline(admin.TabularInline):
     model = Operation
     readonly_fields = ['created_at']
@@ -44,11 +53,11 @@ class ActivationStatusListFilter(admin.SimpleListFilter):
 
     def queryset(self, request, queryset):
         if self.value() == '0':
-            return queryset.filter(extra__devices__0__activation_status=False)
+            return queryset.filter(activation_status=False)
         if self.value() == '1':
-            return queryset.filter(extra__devices__0__activation_status=True)
+            return queryset.filter(activation_status=True)
         if self.value() == '2':
-            return queryset.filter(extra__devices__isnull=True)
+            return queryset.filter(activation_status__isnull=True)
 
 
 @admin.register(Article)
@@ -57,7 +66,7 @@ class ArticleAdmin(admin.ModelAdmin):
     fieldsets = (
         (None, {
             'fields': (
-                ('product', 'serial'), 'barcode', 'imei', 'mac_set', 'success',
+                ('product', 'serial'), 'barcode', 'imei', 'mac_set', ('success', 'activation_status'),
                 ('created_by', 'created_at'),
                 'extra',
             ),
@@ -65,27 +74,55 @@ class ArticleAdmin(admin.ModelAdmin):
     )
     list_display = ('product', 'barcode', 'serial', 'imei', 'mac_set', 'success', 'activation_status', 'created_at')
     list_filter = ('success', ActivationStatusListFilter)
+    list_select_related = ('product',)
     search_fields = ('barcode', 'serial')
-    readonly_fields = ('imei', 'created_at', 'mac_set')
+    readonly_fields = ('imei', 'created_at', 'mac_set', 'activation_status')
     inlines = [
         OperationsInline,
     ]
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    def get_queryset(self, request):
+        return super(ArticleAdmin, self).get_queryset(request).with_macs()
+
+    def get_search_results(self, request, queryset, search_term):
+        """
+        Barcode prefix, exact serial, IMEI or MAC, all answered by an index.
+        The barcode prefix is case-sensitive, the search form says so.
+        """
+        search_term = search_term.strip()
+        if not search_term:
+            return queryset, False
+        query = models.Q(barcode__startswith=search_term)
+        if search_term.isdigit() and int(search_term) <= SERIAL_MAX:
+            query |= models.Q(serial=int(search_term))
+        article = find_articles([search_term], Article.objects.all())[search_term]
+        if article is not None:
+            query |= models.Q(pk=article.pk)
+        return queryset.filter(query), False
 
     def imei(self, obj):
         return obj.imei
     imei.short_description = 'IMEI'
 
     def mac_set(self, obj):
-        return list(obj.mac_set.all())
+        return obj.macs
     mac_set.short_description = _('MAC address')
 
-    def activation_status(self, obj):
-        if obj.extra is None:
-            return
 
-        devices = obj.extra.get('devices')
-        if devices:
-            return devices[0].get('activation_status')
+@admin.register(ActivationRun)
+class ActivationRunAdmin(admin.ModelAdmin):
+    list_display = ('created_at', 'finished_at', 'total', 'processed', 'failed', 'remaining', 'throughput')
+    readonly_fields = ('created_at', 'finished_at', 'total', 'processed', 'failed', 'remaining', 'throughput')
+
+    def remaining(self, obj):
+        return obj.remaining
+    remaining.short_description = _('remaining')
+
+    def throughput(self, obj):
+        return f'{obj.throughput:.1f}'
+    throughput.short_description = _('articles per second')
 
-    activation_status.short_description = _('activation status')
-    activation_status.boolean = True
+    def has_add_permission(self, request):
+        return False
@@ -1,7 +1,12 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_migrate
 from django.utils.translation import gettext_lazy as _
 
 
 class ProductsConfig(AppConfig):
     name = 'products'
     verbose_name = _('Products')
+
+    def ready(self):
+        from .indexes import sync_extra_indexes
+        post_migrate.connect(sync_extra_indexes, sender=self)
@@ -0,0 +1,113 @@
+from functools import lru_cache
+
+# Предварительно рассчитанные результаты умножения на 2 с вычетом 9 для больших цифр
+# Номер индекса равен числу, над которым проводится операция
+LOOKUP = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
+
+
+def luhn(code):
+    code = ''.join(filter(str.isdigit, code))
+    evens = sum(int(i) for i in code[0::2])
+    odds = sum(LOOKUP[int(i)] for i in code[1::2])
+    return 10 - (evens + odds) % 10 if (evens + odds) % 10 else (evens + odds) % 10
+
+
+class ProductCodec:
+    """
+    Formats serial numbers, IMEIs and MAC addresses of one product.
+
+    Everything that depends only on the product (TAC and its Luhn sum, OUI,
+    ``mac_start``, serial mask) is computed once, so formatting an article
+    costs a few string operations. Use ``ProductCodec.for_product`` to get
+    a shared instance.
+    """
+
+    def __init__(self, serial_mask=None, body_identifier=None, mark=None, fac=None, oui=None, mac_start=None):
+        self._serial_format = serial_mask.format if serial_mask else None
+
+        self.tac = None
+        if body_identifier is not None:
+            self.tac = '{}-{}{}'.format(body_identifier, mark, fac)
+            digits = self._tac_digits = ''.join(filter(str.isdigit, self.tac))
+            tac_sum = sum(int(d) if i % 2 == 0 else LOOKUP[int(d)] for i, d in enumerate(digits))
+            # Luhn sums of the upper and lower three serial digits, by their position after the TAC.
+            self._high_sums = tuple(tac_sum + self._luhn_sum(f'{n:0>3}', len(digits)) for n in range(1000))
+            self._low_sums = tuple(self._luhn_sum(f'{n:0>3}', len(digits) + 3) for n in range(1000))
+
+        self._mac_prefix = None
+        if oui and mac_start:
+            self._oui = oui.upper()
+            self._mac_prefix = '-'.join(self._oui[i:i + 2] for i in range(0, 6, 2)) + '-'
+            self._mac_start = int(mac_start, 16)
+
+    @staticmethod
+    def _luhn_sum(digits, position):
+        return sum(int(d) if (position + i) % 2 == 0 else LOOKUP[int(d)] for i, d in enumerate(digits))
+
+    @classmethod
+    def for_product(cls, product):
+        return cls._cached(product.serial_mask, product.body_identifier, product.mark, product.fac, product.oui,
+                           product.mac_start)
+
+    @classmethod
+    @lru_cache(maxsize=256)
+    def _cached(cls, *fields):
+        return cls(*fields)
+
+    def serial_number(self, serial):
+        if self._serial_format:
+            return self._serial_format(serial=serial)
+        return serial
+
+    def serial_numbers(self, serials):
+        if self._serial_format:
+            serial_format = self._serial_format
+            return [serial_format(serial=serial) for serial in serials]
+        return list(serials)
+
+    def imei(self, serial):
+        if self.tac is None:
+            return
+        high, low = divmod(serial, 1000)
+        if high >= len(self._high_sums):
+            # Серийник не влезает в IMEI, считаем как раньше без таблиц
+            identity = f'{self.tac}-{serial:0>6}'
+            return f'{identity}-{luhn(identity)}'
+        return f'{self.tac}-{serial:0>6}-{-(self._high_sums[high] + self._low_sums[low]) % 10}'
+
+    def imeis(self, serials):
+        if self.tac is None:
+            return [None] * len(serials)
+        imei = self.imei
+        return [imei(serial) for serial in serials]
+
+    def mac(self, offset):
+        if self._mac_prefix is None:
+            return
+        ei = self._mac_start + offset
+        return f'{self._mac_prefix}{ei >> 16:02X}-{ei >> 8 & 0xff:02X}-{ei & 0xff:02X}'
+
+    def macs(self, offsets):
+        if self._mac_prefix is None:
+            return []
+        prefix, start = self._mac_prefix, self._mac_start
+        return [f'{prefix}{ei >> 16:02X}-{ei >> 8 & 0xff:02X}-{ei & 0xff:02X}' for ei in (start + o for o in offsets)]
+
+    def serial_from_imei(self, digits):
+        """
+        Serial of an IMEI given as digits only, ``None`` if the TAC is not this
+        product's or the check digit is wrong.
+        """
+        if self.tac is None or len(digits) != len(self._tac_digits) + 7 or not digits.startswith(self._tac_digits):
+            return
+        serial = int(digits[len(self._tac_digits):-1])
+        if self.imei(serial)[-1] == digits[-1]:
+            return serial
+
+    def offset_from_mac(self, digits):
+        """MAC offset of a MAC given as 12 hex digits, ``None`` if it is not in this product's range."""
+        if self._mac_prefix is None or digits[:6].upper() != self._oui:
+            return
+        offset = int(digits[6:], 16) - self._mac_start
+        if offset >= 0:
+            return offset
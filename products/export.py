@@ -0,0 +1,138 @@
+import csv
+import json
+import zipfile
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+EXPORT_FIELDS = ['product', 'barcode', 'serial', 'imei', 'mac', 'success', 'activation_status', 'created_at',
+                 'extra']
+
+CONTENT_TYPES = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iterate_chunks(queryset, chunk_size=1000):
+    """
+    Yield lists of articles in ``-id`` order, one query per chunk.
+
+    Chunks are taken by keyset on ``id`` instead of ``iterator()`` because
+    prefetching MACs does not work with ``iterator()``. Only one chunk is
+    kept in memory at a time.
+    """
+    queryset = queryset.with_macs().order_by('-id')
+    last_id = None
+    while True:
+        chunk = queryset if last_id is None else queryset.filter(id__lt=last_id)
+        chunk = list(chunk[:chunk_size])
+        if not chunk:
+            return
+        yield chunk
+        last_id = chunk[-1].id
+
+
+def export_rows(queryset, chunk_size=1000):
+    """Yield lists of export rows, one list per chunk of articles."""
+    for chunk in iterate_chunks(queryset, chunk_size):
+        by_product = {}
+        for article in chunk:
+            by_product.setdefault(article.product, []).append(article)
+
+        formatted = {}
+        for product, articles in by_product.items():
+            serials = [article.serial for article in articles]
+            formatted.update(zip(articles, zip(product.codec.serial_numbers(serials), product.codec.imeis(serials))))
+
+        yield [{
+            'product': article.product.name,
+            'barcode': article.barcode,
+            'serial': formatted[article][0],
+            'imei': formatted[article][1],
+            'mac': article.macs,
+            'success': article.success,
+            'activation_status': article.activation_status,
+            'created_at': article.created_at,
+            'extra': article.extra,
+        } for article in chunk]
+
+
+class Echo:
+    """File-like object that returns what is written instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+class ZipBuffer:
+    """
+    Write-only, non-seekable target for ``zipfile``, emptied by ``pop()``.
+
+    Without ``seek``/``tell`` ``zipfile`` writes sizes in data descriptors
+    after each member, so an archive can be sent while it is being built.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_zip(files, chunk_size=1024 * 1024):
+    """
+    Yield a zip archive of ``(arcname, path)`` pairs piece by piece.
+
+    Members are stored uncompressed, media is mostly compressed already.
+    At most one ``chunk_size`` piece of a file is held in memory.
+    """
+    buffer = ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_STORED) as archive:
+        for arcname, path in files:
+            info = zipfile.ZipInfo.from_file(path, arcname)
+            with open(path, 'rb') as source, archive.open(info, 'w') as member:
+                for chunk in iter(lambda: source.read(chunk_size), b''):
+                    member.write(chunk)
+                    yield buffer.pop()
+            yield buffer.pop()
+    yield buffer.pop()
+
+
+def media_files(media):
+    """``(arcname, path)`` pairs of ``MediaFile`` rows, in a folder per article barcode."""
+    for media_file in media.select_related('article').order_by('article_id', 'name').iterator():
+        yield f'{media_file.article.barcode}/{media_file.name}', media_file.absolute_path
+
+
+def csv_row(row):
+    return [
+        row['product'], row['barcode'], row['serial'], row['imei'], ' '.join(row['mac']), row['success'],
+        row['activation_status'], row['created_at'].isoformat(), json.dumps(row['extra'], ensure_ascii=False),
+    ]
+
+
+def stream_csv(queryset, chunk_size=1000):
+    writer = csv.writer(Echo())
+    yield writer.writerow(EXPORT_FIELDS)
+    for rows in export_rows(queryset, chunk_size):
+        yield ''.join(writer.writerow(csv_row(row)) for row in rows)
+
+
+def stream_ndjson(queryset, chunk_size=1000):
+    for rows in export_rows(queryset, chunk_size):
+        yield ''.join(json.dumps(row, cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in rows)
+
+
+STREAMS = {
+    'csv': stream_csv,
+    'ndjson': stream_ndjson,
+}
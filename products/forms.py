@@ -1,4 +1,7 @@
+import os
+
 from django import forms
+from django.conf import settings
 
 from .models import Product
 
@@ -7,3 +10,22 @@ class MediaForm(forms.Form):
     product = forms.ModelChoiceField(queryset=Product.objects.all(), label='product')
     serial = forms.IntegerField(label='serial', max_value=999999)
     files = forms.FileField(widget=forms.ClearableFileInput(attrs={'multiple': True}))
+
+
+class UploadForm(forms.Form):
+    product = forms.ModelChoiceField(queryset=Product.objects.all(), label='product')
+    serial = forms.IntegerField(label='serial', min_value=0, max_value=999999)
+    name = forms.CharField(label='name', max_length=255)
+    size = forms.IntegerField(label='size', min_value=1)
+
+    def clean_name(self):
+        name = self.cleaned_data['name']
+        if os.path.basename(name) != name or name in ('.', '..'):
+            raise forms.ValidationError('name must not contain a path')
+        return name
+
+    def clean_size(self):
+        size = self.cleaned_data['size']
+        if size > settings.MEDIA_UPLOAD_MAX_SIZE:
+            raise forms.ValidationError(f'size must not exceed {settings.MEDIA_UPLOAD_MAX_SIZE}')
+        return size
@@ -0,0 +1,39 @@
+import json
+
+from django.db import NotSupportedError
+from django.db.models import Func, JSONField
+
+
+class JSONMerge(Func):
+    """
+    Shallow merge of a JSON object into a JSON column, like ``dict.update``.
+
+    PostgreSQL uses ``||``, SQLite sets every key with ``json_set``. Both run
+    in the UPDATE statement, so concurrent merges of different keys do not
+    overwrite each other.
+    """
+    output_field = JSONField()
+
+    def __init__(self, expression, patch, **extra):
+        self.patch = patch
+        super(JSONMerge, self).__init__(expression, **extra)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        raise NotSupportedError(f'JSONMerge is not supported on {connection.vendor}.')
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        return f"(COALESCE({lhs}, '{{}}'::jsonb) || %s::jsonb)", (*params, json.dumps(self.patch))
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        lhs, params = compiler.compile(self.source_expressions[0])
+        if not self.patch:
+            return lhs, params
+        paths = []
+        for key, value in self.patch.items():
+            if '"' in key:
+                # JSON paths of SQLite have no way to escape a double quote.
+                raise NotSupportedError(f'Key {key!r} can not be merged on sqlite.')
+            paths.append('%s, json(%s)')
+            params = (*params, f'$."{key}"', json.dumps(value))
+        return f"json_set(COALESCE({lhs}, '{{}}'), {', '.join(paths)})", params
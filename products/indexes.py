@@ -0,0 +1,55 @@
+import hashlib
+import re
+
+from django.conf import settings
+from django.db import connections, DEFAULT_DB_ALIAS
+
+from .models import Article
+
+EXTRA_INDEX_PREFIX = 'products_article_extra_'
+
+
+def extra_index_name(key):
+    slug = re.sub(r'\W', '_', key.lower())[:30]
+    return f'{EXTRA_INDEX_PREFIX}{slug}_{hashlib.md5(key.encode()).hexdigest()[:8]}'
+
+
+def indexed_extra_keys(using=DEFAULT_DB_ALIAS):
+    """Keys of ``Article.extra`` with an expression index, empty unless the database is PostgreSQL."""
+    if connections[using].vendor != 'postgresql':
+        return frozenset()
+    return frozenset(settings.ARTICLE_EXTRA_INDEXED_KEYS)
+
+
+def sync_extra_indexes(using=DEFAULT_DB_ALIAS, verbosity=1, **kwargs):
+    """
+    Create a GIN index on ``extra -> key`` for every key in ``ARTICLE_EXTRA_INDEXED_KEYS``
+    and drop the indexes of keys removed from it. Runs after ``migrate``.
+
+    Filters on these keys add ``@>`` containment, which ``jsonb_path_ops``
+    indexes support, to the exact match.
+    """
+    connection = connections[using]
+    if connection.vendor != 'postgresql':
+        return
+
+    table = Article._meta.db_table
+    expected = {extra_index_name(key): key for key in settings.ARTICLE_EXTRA_INDEXED_KEYS}
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname LIKE %s',
+                       [table, f'{EXTRA_INDEX_PREFIX}%'])
+        existing = {name for name, in cursor.fetchall()}
+
+        for name in existing - set(expected):
+            cursor.execute(f'DROP INDEX CONCURRENTLY IF EXISTS {connection.ops.quote_name(name)}')
+            if verbosity:
+                print(f'  Dropped index {name}')
+
+        for name, key in expected.items():
+            if name in existing:
+                continue
+            cursor.execute(
+                f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {connection.ops.quote_name(name)} '
+                f'ON {connection.ops.quote_name(table)} USING gin ((extra -> %s) jsonb_path_ops)', [key])
+            if verbosity:
+                print(f'  Created index {name} on extra -> {key!r}')
@@ -0,0 +1,119 @@
+from bisect import bisect_right
+from collections import defaultdict
+import re
+
+from django.conf import settings
+from django.db import connections
+
+from .models import Product, Article, Mac, MacRange
+
+IMEI_REGEX = re.compile(r'^\d{15}$')
+MAC_REGEX = re.compile(r'^[0-9A-Fa-f]{12}$')
+
+
+def normalize(identifier):
+    return re.sub(r'[\s:.-]', '', identifier)
+
+
+def decode(identifier, products):
+    """
+    ``('imei', product, serial)`` or ``('mac', product, offset)`` candidates
+    for an IMEI or MAC, computed from the products' TAC and OUI without queries.
+    """
+    digits = normalize(identifier)
+    if IMEI_REGEX.match(digits):
+        for product in products:
+            serial = product.codec.serial_from_imei(digits)
+            if serial is not None:
+                yield 'imei', product, serial
+    if MAC_REGEX.match(digits):
+        for product in products:
+            offset = product.codec.offset_from_mac(digits)
+            if offset is not None and offset <= int(product.mac_end or 'ffffff', 16) - int(product.mac_start, 16):
+                yield 'mac', product, offset
+
+
+# Offsets looked up per range query, two parameters each, below the 999
+# parameters SQLite allows.
+RANGE_LOOKUP_BATCH = 400
+
+
+def by_product(pairs):
+    grouped = defaultdict(list)
+    for product_id, value in pairs:
+        grouped[product_id].append(value)
+    return grouped
+
+
+def find_ranges(offsets):
+    """
+    Map ``(product_id, offset)`` pairs to the article ids of the MAC ranges
+    holding them. Works like ``MacRange.objects.find`` for many offsets at
+    once: each range is found by its ``start``, the nearest one not past the offset.
+    """
+    offsets = sorted(offsets)
+    ranges = defaultdict(dict)
+    connection = connections[MacRange.objects.db]
+    table = connection.ops.quote_name(MacRange._meta.db_table)
+    with connection.cursor() as cursor:
+        for i in range(0, len(offsets), RANGE_LOOKUP_BATCH):
+            batch = offsets[i:i + RANGE_LOOKUP_BATCH]
+            # Built in SQL: a thousand ORM subqueries take longer to compile than to run.
+            cursor.execute(
+                f'SELECT product_id, start, count, article_id FROM {table} '
+                f'WHERE (product_id, start) IN (SELECT v.column1, ('
+                f'SELECT MAX(r.start) FROM {table} r WHERE r.product_id = v.column1 AND r.start <= v.column2'
+                f') FROM (VALUES {", ".join(["(%s, %s)"] * len(batch))}) v)',
+                [value for pair in batch for value in pair])
+            for product_id, start, count, article_id in cursor.fetchall():
+                ranges[product_id][start] = (count, article_id)
+
+    result = {}
+    for product_id, product_offsets in by_product(offsets).items():
+        starts = sorted(ranges[product_id])
+        for offset in product_offsets:
+            index = bisect_right(starts, offset) - 1
+            if index < 0:
+                continue
+            count, article_id = ranges[product_id][starts[index]]
+            if offset < starts[index] + count and article_id:
+                result[product_id, offset] = article_id
+    return result
+
+
+def find_articles(identifiers, queryset=None):
+    """
+    Map each IMEI or MAC in ``identifiers`` to its article, ``None`` if there is none.
+
+    Identifiers are decoded arithmetically, so articles are fetched by the
+    unique (product, serial) and (product, mac) indexes instead of a scan,
+    with one query per product.
+    """
+    if queryset is None:
+        queryset = Article.objects.with_macs()
+    products = list(Product.objects.all())
+
+    keys = {identifier: [(kind, product.pk, value) for kind, product, value in decode(identifier, products)]
+            for identifier in identifiers}
+    serials = {(product_id, value) for key in keys.values() for kind, product_id, value in key if kind == 'imei'}
+    offsets = {(product_id, value) for key in keys.values() for kind, product_id, value in key if kind == 'mac'}
+
+    by_key = {}
+    for product_id, product_serials in by_product(serials).items():
+        found = Article.objects.filter(product_id=product_id, serial__in=product_serials)
+        for pk, serial in found.values_list('pk', 'serial'):
+            by_key['imei', product_id, serial] = pk
+    if settings.MAC_STORAGE == 'range':
+        for (product_id, offset), article_id in find_ranges(offsets).items():
+            by_key['mac', product_id, offset] = article_id
+    else:
+        for product_id, product_offsets in by_product(offsets).items():
+            macs = Mac.objects.filter(product_id=product_id, mac__in=product_offsets, article__isnull=False)
+            for mac, article_id in macs.values_list('mac', 'article_id'):
+                by_key['mac', product_id, mac] = article_id
+
+    articles = queryset.in_bulk(set(by_key.values())) if by_key else {}
+    return {
+        identifier: next((articles[by_key[key]] for key in key_list if by_key.get(key) in articles), None)
+        for identifier, key_list in keys.items()
+    }
@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from products.models import Article, activation_status
+
+
+class Command(BaseCommand):
+    help = 'Fill Article.activation_status from extra["devices"] for existing articles'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        articles = Article.objects.only('pk', 'extra', 'activation_status', 'modified_at').order_by('pk')
+        last_pk = 0
+        updated = 0
+        while True:
+            batch = list(articles.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1].pk
+
+            changed = []
+            for article in batch:
+                status = activation_status(article.extra)
+                if article.activation_status != status:
+                    article.activation_status = status
+                    article.modified_at = timezone.now()
+                    changed.append(article)
+            Article.objects.bulk_update(changed, ['activation_status', 'modified_at'])
+            updated += len(changed)
+
+        self.stdout.write(f'{updated} articles updated')
@@ -0,0 +1,186 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+import logging
+import os
+import statistics
+import tempfile
+import threading
+import time
+import uuid
+
+import requests
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management.base import BaseCommand
+from django.db import connection, IntegrityError
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+
+from accounts.models import User
+from products.models import Product, Article, Counter, Mac, MacRange, MediaFile
+from products.storage import get_media_storage
+
+SCENARIOS = ('articles', 'operations', 'upload')
+USER = 'benchmark-api@localhost'
+PASSWORD = 'benchmark-api'
+
+
+class LocalClient:
+    """Drives the views in process with the test client, one database connection per thread."""
+
+    def __init__(self):
+        self.client = Client(raise_request_exception=True)
+        self.client.login(username=USER, password=PASSWORD)
+        self.auth = 'Basic ' + base64.b64encode(f'{USER}:{PASSWORD}'.encode()).decode()
+
+    def post_json(self, path, data):
+        return self.client.post(path, data, content_type='application/json').status_code
+
+    def post_files(self, path, data):
+        return self.client.post(path, data, HTTP_AUTHORIZATION=self.auth).status_code
+
+    def close(self):
+        connection.close()
+
+
+class RemoteClient:
+    """Drives a running server, e.g. gunicorn in front of PostgreSQL, over HTTP."""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.session = requests.Session()
+        self.session.auth = (USER, PASSWORD)
+
+    def post_json(self, path, data):
+        return self.session.post(self.url + path, json=data).status_code
+
+    def post_files(self, path, data):
+        files = {'files': (data['files'].name, data['files'].read())}
+        fields = {key: value for key, value in data.items() if key != 'files'}
+        return self.session.post(self.url + path, data=fields, files=files).status_code
+
+    def close(self):
+        self.session.close()
+
+
+class Command(BaseCommand):
+    help = ('Load-test article allocation, operation and media upload endpoints with concurrent clients and report '
+            'throughput, latency percentiles, queries per request and unique constraint failures')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scenario', choices=SCENARIOS + ('all',), default='all')
+        parser.add_argument('--clients', type=int, default=4, help='Concurrent clients')
+        parser.add_argument('--requests', type=int, default=100, help='Requests per client')
+        parser.add_argument('--seed', type=int, default=10000, help='Articles of the benchmark product to start with')
+        parser.add_argument('--mac-quantity', type=int, default=2)
+        parser.add_argument('--upload-size', type=int, default=256, help='Uploaded file size, KB')
+        parser.add_argument('--url', help='Base URL of a running server instead of the in-process test client')
+        parser.add_argument('--cleanup', action='store_true', help='Delete the benchmark product afterwards')
+
+    def handle(self, *args, **options):
+        product = self.seed(options)
+        scenarios = SCENARIOS if options['scenario'] == 'all' else (options['scenario'],)
+        self.stdout.write(f'{connection.vendor}, {Article.objects.filter(product=product).count()} articles, '
+                          f'{options["clients"]} clients x {options["requests"]} requests')
+
+        # Failed requests are counted in the report instead of logged one by one.
+        logging.getLogger('django.request').setLevel(logging.CRITICAL)
+        media_root = tempfile.mkdtemp(prefix='benchmark-api-')
+        # The test client answers as 'testserver', uploads go to a throwaway MEDIA_ROOT.
+        with override_settings(ALLOWED_HOSTS=['*'], MEDIA_ROOT=media_root):
+            get_media_storage.cache_clear()
+            try:
+                for scenario in scenarios:
+                    self.report(scenario, self.run(scenario, product, options))
+            finally:
+                get_media_storage.cache_clear()
+
+        if options['cleanup']:
+            self.cleanup(product)
+
+    def seed(self, options):
+        user = User.objects.filter(email=USER).first()
+        if user is None:
+            user = User.objects.create_superuser(USER, PASSWORD)
+        product, _ = Product.objects.get_or_create(name='benchmark-api', defaults={
+            'body_identifier': '35', 'mark': '0000', 'fac': '00', 'mac_quantity': options['mac_quantity'],
+            'oui': '000000', 'mac_start': '000000', 'mac_end': 'ffffff',
+        })
+        missing = options['seed'] - Article.objects.filter(product=product).count()
+        while missing > 0:
+            batch = min(missing, 1000)
+            Article.objects.allocate(product, [f'benchmark-api-{uuid.uuid4().hex}' for _ in range(batch)], user)
+            missing -= batch
+        return product
+
+    def run(self, scenario, product, options):
+        barcodes = list(Article.objects.filter(product=product).values_list('barcode', flat=True)[:1000])
+        payload = os.urandom(options['upload_size'] * 1024)
+        serials = count(1)
+        lock = threading.Lock()
+
+        def request(client, i):
+            if scenario == 'articles':
+                return client.post_json('/api/articles/', {
+                    'product': product.pk, 'barcode': f'benchmark-api-{uuid.uuid4().hex}'})
+            if scenario == 'operations':
+                return client.post_json('/api/operations/', {
+                    'article': barcodes[i % len(barcodes)], 'type': 1, 'responsible': 'benchmark'})
+            with lock:
+                serial = next(serials)
+            return client.post_files('/articles/upload/', {
+                'product': product.pk, 'serial': serial,
+                'files': SimpleUploadedFile(f'benchmark-{serial}.bin', payload)})
+
+        def worker(n):
+            client = RemoteClient(options['url']) if options['url'] else LocalClient()
+            results = []
+            try:
+                for i in range(options['requests']):
+                    queries = None
+                    error = None
+                    started = time.monotonic()
+                    try:
+                        with CaptureQueriesContext(connection) as captured:
+                            status = request(client, n * options['requests'] + i)
+                        if not options['url']:
+                            queries = len(captured.captured_queries)
+                    except Exception as exc:
+                        status, error = 500, exc
+                    results.append((time.monotonic() - started, status, queries, error))
+            finally:
+                client.close()
+            return results
+
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=options['clients']) as executor:
+            results = [result for results in executor.map(worker, range(options['clients'])) for result in results]
+        return time.monotonic() - started, results
+
+    def report(self, scenario, run):
+        elapsed, results = run
+        latencies = sorted(latency * 1000 for latency, _status, _queries, _error in results)
+        failed = [(status, error) for _latency, status, _queries, error in results if status >= 400]
+        integrity = sum(isinstance(error, IntegrityError) for _status, error in failed)
+        queries = [queries for _latency, _status, queries, _error in results if queries is not None]
+        percentiles = statistics.quantiles(latencies, n=100, method='inclusive') if len(latencies) > 1 else latencies * 99
+
+        self.stdout.write(f'\n{scenario}: {len(results)} requests in {elapsed:.2f} s, '
+                          f'{len(results) / elapsed:.1f} requests/s')
+        self.stdout.write(f'  latency ms: p50 {percentiles[49]:.1f}, p90 {percentiles[89]:.1f}, '
+                          f'p99 {percentiles[98]:.1f}, max {latencies[-1]:.1f}')
+        if queries:
+            self.stdout.write(f'  queries per request: mean {statistics.mean(queries):.1f}, max {max(queries)}')
+        self.stdout.write(f'  failed: {len(failed)}, unique constraint violations: {integrity}')
+        errors = {}
+        for status, error in failed:
+            key = type(error).__name__ if error else f'HTTP {status}'
+            errors[key] = errors.get(key, 0) + 1
+        for key, number in errors.items():
+            self.stdout.write(f'    {key}: {number}')
+
+    def cleanup(self, product):
+        for model in (Mac, MacRange, MediaFile, Article, Counter):
+            model.objects.filter(product=product).delete()
+        product.delete()
+        User.objects.filter(email=USER).delete()
@@ -0,0 +1,66 @@
+from functools import reduce
+import timeit
+
+from django.core.management.base import BaseCommand
+import netaddr
+
+from products.codec import LOOKUP, ProductCodec
+from products.models import Product
+
+
+def legacy_luhn(code):
+    code = reduce(str.__add__, filter(str.isdigit, code))
+    evens = sum(int(i) for i in code[0::2])
+    odds = sum(LOOKUP[int(i)] for i in code[1::2])
+    return 10 - (evens + odds) % 10 if (evens + odds) % 10 else (evens + odds) % 10
+
+
+def legacy_imei(product, serial):
+    if product.body_identifier is None:
+        return
+    tac = '{}-{}{}'.format(product.body_identifier, product.mark, product.fac)
+    identity = '{}-{:0>6}'.format(tac, serial)
+    return f'{identity}-{legacy_luhn(identity)}'
+
+
+def legacy_serial_number(product, serial):
+    if product.serial_mask:
+        return product.serial_mask.format(serial=serial)
+    return serial
+
+
+def legacy_mac(product, mac):
+    return str(netaddr.EUI(f'{product.oui}{int(product.mac_start, 16) + mac:0>6x}'))
+
+
+class Command(BaseCommand):
+    help = 'Compare ProductCodec with the per-call identifier formatting it replaced'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=100, help='Identifiers per call, e.g. one API page')
+        parser.add_argument('--repeat', type=int, default=200)
+
+    def handle(self, *args, **options):
+        product = Product(name='benchmark', serial_mask='BT{serial:0>6}', body_identifier='35', mark='1234',
+                          fac='56', mac_quantity=4, oui='a0b1c2', mac_start='100000', mac_end='ffffff')
+        codec = ProductCodec.for_product(product)
+        serials = list(range(1, options['count'] + 1))
+
+        for serial in serials:
+            mac = serial * product.mac_quantity
+            assert codec.imei(serial) == legacy_imei(product, serial)
+            assert codec.serial_number(serial) == legacy_serial_number(product, serial)
+            assert codec.mac(mac) == legacy_mac(product, mac)
+
+        cases = (
+            ('imei', lambda: [legacy_imei(product, s) for s in serials], lambda: codec.imeis(serials)),
+            ('serial', lambda: [legacy_serial_number(product, s) for s in serials],
+             lambda: codec.serial_numbers(serials)),
+            ('mac', lambda: [legacy_mac(product, s) for s in serials], lambda: codec.macs(serials)),
+        )
+        self.stdout.write(f'{len(serials)} identifiers per call, best of 5 x {options["repeat"]} calls')
+        for name, legacy, current in cases:
+            legacy_time = min(timeit.repeat(legacy, number=options['repeat'], repeat=5)) / options['repeat']
+            codec_time = min(timeit.repeat(current, number=options['repeat'], repeat=5)) / options['repeat']
+            self.stdout.write(f'{name:>6}: legacy {legacy_time * 1e6:9.1f} us, codec {codec_time * 1e6:9.1f} us, '
+                              f'x{legacy_time / codec_time:.1f}')
@@ -0,0 +1,67 @@
+import json
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import override_settings
+
+from accounts.models import User
+from products.indexes import sync_extra_indexes
+from products.models import Product, Article, Counter
+from products.views import ArticleFilterSet
+
+
+class Command(BaseCommand):
+    help = 'Seed articles with extra data and time the API extra filter with and without key indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000000)
+        parser.add_argument('--key', default='station')
+        parser.add_argument('--values', type=int, default=1000, help='Distinct values of the key')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--cleanup', action='store_true', help='Delete the seeded articles afterwards')
+
+    def handle(self, *args, **options):
+        product = self.seed(options)
+        value = f'{options["key"]}-{options["values"] // 2}'
+        data = {'extra': json.dumps({options['key']: value})}
+
+        cases = [('not indexed', [])]
+        if connection.vendor == 'postgresql':
+            cases.append(('indexed', [options['key']]))
+        else:
+            self.stdout.write('Key indexes need PostgreSQL, timing the fallback only')
+
+        for name, keys in cases:
+            with override_settings(ARTICLE_EXTRA_INDEXED_KEYS=keys):
+                sync_extra_indexes(verbosity=0)
+                queryset = ArticleFilterSet(data=data, queryset=Article.objects.order_by('-id')).qs
+                timings = []
+                for _ in range(options['repeat']):
+                    started = time.monotonic()
+                    count = queryset.count()
+                    list(queryset[:100])
+                    timings.append(time.monotonic() - started)
+                self.stdout.write(f'{name}: {count} of {options["rows"]} rows matched, '
+                                  f'best {min(timings) * 1000:.1f} ms, worst {max(timings) * 1000:.1f} ms')
+                self.stdout.write(queryset[:100].explain())
+
+        sync_extra_indexes(verbosity=0)
+        if options['cleanup']:
+            Article.objects.filter(product=product).delete()
+
+    def seed(self, options):
+        user, _ = User.objects.get_or_create(email='benchmark-extra@localhost')
+        product, _ = Product.objects.get_or_create(name='benchmark-extra')
+        missing = options['rows'] - Article.objects.filter(product=product).count()
+        while missing > 0:
+            count = min(missing, options['batch_size'])
+            first = Counter.objects.reserve(product, 'serial', count)
+            Article.objects.bulk_create([
+                Article(product=product, serial=serial, barcode=f'benchmark-extra-{serial}', created_by=user,
+                        extra={options['key']: f'{options["key"]}-{serial % options["values"]}', 'result': 'ok'})
+                for serial in range(first, first + count)
+            ])
+            missing -= count
+        return product
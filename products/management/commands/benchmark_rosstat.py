@@ -0,0 +1,40 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import User
+from products.models import Product, Article
+from products.rosstat import RosstatChecker, FakeRosstatAdapter
+
+
+class Command(BaseCommand):
+    help = 'Measure activation check throughput against an offline fake of the RosStat API'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=1000, help='Articles to check')
+        parser.add_argument('--latency', type=float, default=0.2, help='Fake upstream latency, seconds')
+        parser.add_argument('--rate', type=float, default=50, help='Requests started per second')
+        parser.add_argument('--concurrency', type=int, default=16)
+        parser.add_argument('--batch-size', type=int, default=100)
+
+    def handle(self, *args, **options):
+        # Everything is created in a transaction that is rolled back at the end.
+        with transaction.atomic():
+            user = User.objects.create_user('benchmark-rosstat@localhost')
+            product = Product.objects.create(name='benchmark-rosstat', body_identifier='35', mark='0000', fac='00')
+            Article.objects.allocate(product, [f'benchmark-rosstat-{i}' for i in range(options['count'])], user)
+            articles = Article.objects.filter(product=product).select_related('product')
+
+            adapter = FakeRosstatAdapter(latency=options['latency'])
+            checker = RosstatChecker(rate=options['rate'], concurrency=options['concurrency'],
+                                     batch_size=options['batch_size'], adapter=adapter)
+            started = time.monotonic()
+            updated = checker.run(articles.iterator())
+            elapsed = time.monotonic() - started
+
+            transaction.set_rollback(True)
+
+        self.stdout.write(f'{adapter.requests} requests, {updated} articles updated in {elapsed:.2f} s, '
+                          f'{updated / elapsed:.1f} articles/s')
+        self.stdout.write(f'sequential check with time.sleep(1) would take {options["count"] * (options["latency"] + 1):.0f} s')
@@ -0,0 +1,64 @@
+import base64
+from functools import wraps
+import time
+
+from django.contrib.auth import authenticate, login
+from django.contrib.auth.decorators import login_required
+from django.contrib.auth.middleware import AuthenticationMiddleware
+from django.contrib.sessions.middleware import SessionMiddleware
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from accounts.models import User
+from products.views import http_basic_auth
+
+
+def login_basic_auth(func):
+    """``http_basic_auth`` as it was before credentials were cached: a password hash and a session per request."""
+    @wraps(func)
+    def _decorator(request, *args, **kwargs):
+        auth_method, auth = request.META['HTTP_AUTHORIZATION'].split(' ', 1)
+        username, password = base64.b64decode(auth.strip()).decode().split(':', 1)
+        user = authenticate(request, username=username, password=password)
+        if user:
+            login(request, user)
+        return func(request, *args, **kwargs)
+
+    return _decorator
+
+
+def station_view(request):
+    return HttpResponse()
+
+
+class Command(BaseCommand):
+    help = 'Measure requests per second of station basic auth with authenticate() + login() and with the cache'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+
+    def handle(self, *args, **options):
+        factory = RequestFactory()
+        credentials = base64.b64encode(b'benchmark-station@localhost:benchmark').decode()
+        cases = [
+            ('authenticate() + login()', login_basic_auth),
+            ('cached credentials', http_basic_auth),
+        ]
+
+        # Everything is created in a transaction that is rolled back at the end.
+        with transaction.atomic():
+            User.objects.create_user('benchmark-station@localhost', 'benchmark')
+            for name, decorator in cases:
+                cache.clear()
+                handler = SessionMiddleware(AuthenticationMiddleware(decorator(login_required(station_view))))
+                started = time.monotonic()
+                for _ in range(options['requests']):
+                    response = handler(factory.get('/', HTTP_AUTHORIZATION=f'Basic {credentials}'))
+                    assert response.status_code == 200, response.status_code
+                elapsed = time.monotonic() - started
+                self.stdout.write(f'{name}: {options["requests"] / elapsed:.1f} requests/s')
+
+            transaction.set_rollback(True)
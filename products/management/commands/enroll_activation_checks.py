@@ -0,0 +1,29 @@
+from itertools import islice
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from products.models import Article, ActivationCheck
+
+
+class Command(BaseCommand):
+    help = 'Schedule activation checks for existing articles of ROS_PRODUCTS that have none'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        articles = Article.objects.filter(
+            product_id__in=settings.ROS_PRODUCTS, activation_check__isnull=True).only('pk', 'product_id', 'activation_status')
+        articles = articles.iterator()
+        enrolled = 0
+        while True:
+            batch = list(islice(articles, options['batch_size']))
+            if not batch:
+                break
+            activated = [article for article in batch if article.activation_status]
+            pending = [article for article in batch if not article.activation_status]
+            enrolled += len(ActivationCheck.objects.enroll(activated, activated=True))
+            enrolled += len(ActivationCheck.objects.enroll(pending))
+
+        self.stdout.write(f'{enrolled} articles enrolled')
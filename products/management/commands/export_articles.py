@@ -0,0 +1,36 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from products.export import STREAMS
+from products.models import Article
+from products.views import ArticleFilterSet
+
+
+class Command(BaseCommand):
+    help = 'Stream articles with serial, IMEI, MACs, activation status and extra as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=sorted(STREAMS), default='csv')
+        parser.add_argument('--output', help='File to write, standard output by default')
+        parser.add_argument('--chunk-size', type=int, default=1000)
+        parser.add_argument('--product', help='Product id')
+        parser.add_argument('--serial', help='Serial number')
+        parser.add_argument('--extra', help='JSON object of extra keys, as in the API filter')
+        parser.add_argument('--activation-status', choices=['true', 'false'])
+
+    def handle(self, *args, **options):
+        data = {name: options[name] for name in ArticleFilterSet.Meta.fields if options[name] is not None}
+        filterset = ArticleFilterSet(data=data, queryset=Article.objects.all())
+        if not filterset.is_valid():
+            self.stderr.write(str(filterset.errors))
+            sys.exit(1)
+
+        stream = STREAMS[options['format']](filterset.qs, options['chunk_size'])
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                output.writelines(stream)
+        else:
+            self.stdout.ending = ''
+            for chunk in stream:
+                self.stdout.write(chunk)
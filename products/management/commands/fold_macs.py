@@ -0,0 +1,52 @@
+from itertools import groupby
+from operator import itemgetter
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from products.models import Product, Mac, MacRange
+
+
+def runs(macs, size):
+    """Split sorted MAC offsets into contiguous runs of at most ``size`` addresses."""
+    start = count = None
+    for mac in macs:
+        if count and mac == start + count and count < size:
+            count += 1
+            continue
+        if count:
+            yield start, count
+        start, count = mac, 1
+    if count:
+        yield start, count
+
+
+class Command(BaseCommand):
+    help = 'Fold Mac rows into MacRange intervals before switching MAC_STORAGE to "range"'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--product', type=int, help='Fold only the product with this id')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        products = Product.objects.order_by('pk')
+        if options['product']:
+            products = products.filter(pk=options['product'])
+
+        for product in products:
+            with transaction.atomic():
+                macs = Mac.objects.filter(product=product).order_by('article_id', 'mac').values_list('article_id', 'mac')
+                ranges = []
+                created = 0
+                for article_id, rows in groupby(macs.iterator(), key=itemgetter(0)):
+                    # Free MACs are folded into blocks that can be handed out again as a whole.
+                    size = product.mac_quantity if article_id is None and product.mac_quantity else 32767
+                    for start, count in runs((mac for _, mac in rows), size):
+                        ranges.append(MacRange(product=product, article_id=article_id, start=start, count=count))
+                    if len(ranges) >= options['batch_size']:
+                        created += len(MacRange.objects.bulk_create(ranges))
+                        ranges = []
+                created += len(MacRange.objects.bulk_create(ranges))
+                deleted, _ = Mac.objects.filter(product=product).delete()
+
+            self.stdout.write(f'{product}: {deleted} MAC addresses folded into {created} ranges')
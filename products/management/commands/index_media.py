@@ -0,0 +1,21 @@
+import os
+
+from django.core.management.base import BaseCommand
+
+from products.models import MediaFile
+from products.storage import get_media_storage
+
+
+class Command(BaseCommand):
+    help = 'Index media uploaded before MediaFile existed, from MEDIA_ROOT/<product>/<serial>/'
+
+    def handle(self, *args, **options):
+        storage = get_media_storage()
+        indexed = 0
+        for product in filter(str.isdigit, os.listdir(storage.root)):
+            for serial in filter(str.isdigit, os.listdir(os.path.join(storage.root, product))):
+                for stored in storage.stored(product, serial):
+                    MediaFile.objects.record(int(product), int(serial), stored)
+                    indexed += 1
+
+        self.stdout.write(f'{indexed} files indexed')
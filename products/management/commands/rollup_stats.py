@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from products.stats import rollup
+
+
+class Command(BaseCommand):
+    help = 'Recompute daily article and operation statistics'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Only the last DAYS days, all history by default')
+
+    def handle(self, *args, **options):
+        articles, operations = rollup(options['days'])
+        self.stdout.write(f'{articles} article and {operations} operation rows written')
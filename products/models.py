@@ -1,26 +1,40 @@
-from functools import reduce
-
-from django.db import models
+from datetime import timedelta
+import os
+import time
+import uuid
+
+from django.conf import settings
+from django.db import models, transaction, IntegrityError
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MaxValueValidator, RegexValidator, ValidationError
+from django.db.models.functions import Greatest
 from django.dispatch import receiver
-import netaddr
+
+from .codec import ProductCodec
+from .functions import JSONMerge
 
 # Create your models here.
 
 
 MAC_REGEX = r'^(?:[A-Fa-f0-9]{2}([-:]))(?:[A-Fa-f0-9]{2}\1){4}[A-Fa-f0-9]{2}$'
+# Serials take six digits of the IMEI
+SERIAL_MAX = 999999
 
-# Предварительно рассчитанные результаты умножения на 2 с вычетом 9 для больших цифр
-# Номер индекса равен числу, над которым проводится операция
-LOOKUP = (0, 2, 4, 6, 8, 1, 3, 5, 7, 9)
 
-
-def luhn(code):
-    code = reduce(str.__add__, filter(str.isdigit, code))
-    evens = sum(int(i) for i in code[0::2])
-    odds = sum(LOOKUP[int(i)] for i in code[1::2])
-    return 10 - (evens + odds) % 10 if (evens + odds) % 10 else (evens + odds) % 10
+def activation_status(extra):
+    """
+    Activation status of the first device in ``extra['devices']``, ``None`` if
+    unknown. ``extra`` may hold any JSON, so anything but a list of objects
+    with a boolean ``activation_status`` counts as unknown.
+    """
+    if not isinstance(extra, dict):
+        return None
+    devices = extra.get('devices')
+    if not isinstance(devices, list) or not devices or not isinstance(devices[0], dict):
+        return None
+    status = devices[0].get('activation_status')
+    return status if isinstance(status, bool) else None
 
 
 class Product(models.Model):
@@ -56,6 +70,142 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
+    @property
+    def codec(self):
+        return ProductCodec.for_product(self)
+
+    def check_mac_range(self, last_mac, count):
+        """Raise ValidationError if ``count`` MACs after offset ``last_mac`` do not fit before ``mac_end``."""
+        if count and self.mac_end and int(self.mac_start, 16) + last_mac + count > int(self.mac_end, 16):
+            params = {'product': self}
+            raise ValidationError(_('Out of mac addresses for %(product)s'), code='max_value', params=params)
+
+    def check_serial_range(self, last_serial):
+        """Raise ValidationError if serials up to ``last_serial`` do not fit into the six IMEI digits."""
+        if last_serial > SERIAL_MAX:
+            params = {'product': self}
+            raise ValidationError(_('Out of serial numbers for %(product)s'), code='max_value', params=params)
+
+
+class CounterManager(models.Manager):
+    def reserve(self, product, field, count=1):
+        """
+        Atomically advance ``field`` of the product counter by ``count``.
+
+        The counter row is locked with ``select_for_update`` until the
+        surrounding transaction commits, so concurrent workers never get the
+        same values. Returns the first reserved value.
+        """
+        with transaction.atomic():
+            counter = self.select_for_update().filter(product=product).first()
+            if counter is None:
+                counter = self._create(product)
+            first = getattr(counter, field) + 1
+            setattr(counter, field, first + count - 1)
+            counter.save(update_fields=[field])
+        return first
+
+    def advance(self, product, field, value):
+        """Move ``field`` forward to ``value`` if it is behind, e.g. after an explicitly set serial."""
+        with transaction.atomic():
+            if not self.select_for_update().filter(product=product).exists():
+                self._create(product)
+            self.filter(product=product, **{f'{field}__lt': value}).update(**{field: value})
+
+    def _create(self, product):
+        # Seed from existing rows once, then never aggregate again.
+        serial = Article.objects.filter(product=product).aggregate(models.Max('serial'))['serial__max'] or 0
+        mac = max(Mac.objects.last_allocated(product), MacRange.objects.last_allocated(product))
+        try:
+            with transaction.atomic():
+                return self.create(product=product, serial=serial, mac=mac)
+        except IntegrityError:
+            # Created by a concurrent worker in the meantime.
+            return self.select_for_update().get(product=product)
+
+
+class Counter(models.Model):
+    product = models.OneToOneField('Product', on_delete=models.CASCADE, primary_key=True, verbose_name=_('product'))
+    serial = models.PositiveIntegerField(default=0, verbose_name=_('last serial number'))
+    mac = models.IntegerField(default=0, verbose_name=_('last MAC address'))
+
+    objects = CounterManager()
+
+    class Meta:
+        verbose_name = _('counter')
+        verbose_name_plural = _('counters')
+
+    def __str__(self):
+        return str(self.product)
+
+
+def mac_storage():
+    """Manager of the configured MAC storage, ``Mac.objects`` or ``MacRange.objects``."""
+    return MacRange.objects if settings.MAC_STORAGE == 'range' else Mac.objects
+
+
+class BaseMacManager(models.Manager):
+    def last_allocated(self, product):
+        """Offset of the highest MAC stored for ``product``."""
+        raise NotImplementedError
+
+    def free_blocks(self, product):
+        """Number of free blocks of ``product.mac_quantity`` MACs left by deleted articles."""
+        raise NotImplementedError
+
+    def check_available(self, product, count=1):
+        """Raise ValidationError if MACs for ``count`` new articles of ``product`` can't be allocated."""
+        quantity = product.mac_quantity
+        if quantity == 0:
+            return
+
+        last_mac = Counter.objects.filter(product=product).values_list('mac', flat=True).first()
+        if last_mac is None:
+            last_mac = self.last_allocated(product)
+        product.check_mac_range(last_mac, max(count - self.free_blocks(product), 0) * quantity)
+
+
+class MacManager(BaseMacManager):
+    def last_allocated(self, product):
+        return self.filter(product=product).aggregate(models.Max('mac'))['mac__max'] or 0
+
+    def free_blocks(self, product):
+        return self.filter(product=product, article__isnull=True).count() // product.mac_quantity
+
+    def allocate(self, product, articles):
+        """
+        Assign ``product.mac_quantity`` MACs to each of ``articles``.
+
+        Free MACs left by deleted articles are reused first. The rest is
+        reserved as one range with a single counter bump, checked against
+        ``mac_end`` under the counter lock and written with one bulk insert.
+        """
+        quantity = product.mac_quantity
+        articles = list(articles)
+        if quantity == 0 or not articles:
+            return []
+
+        with transaction.atomic():
+            free = list(self.select_for_update(skip_locked=True).filter(
+                product=product, article__isnull=True).order_by('mac')[:quantity * len(articles)])
+            reused = len(free) // quantity
+            free = free[:reused * quantity]
+            for i, mac in enumerate(free):
+                mac.article = articles[i // quantity]
+            self.bulk_update(free, ['article'])
+
+            rest = articles[reused:]
+            if not rest:
+                return free
+
+            count = quantity * len(rest)
+            first_mac = Counter.objects.reserve(product, 'mac', count)
+            product.check_mac_range(first_mac - 1, count)
+            new = self.bulk_create([
+                Mac(product=product, mac=first_mac + i, article=rest[i // quantity]) for i in range(count)
+            ])
+        return free + new
+
 
 class Mac(models.Model):
     product = models.ForeignKey('Product', on_delete=models.PROTECT, verbose_name=_('product'))
@@ -63,6 +213,8 @@ class Mac(models.Model):
     article = models.ForeignKey('Article', on_delete=models.SET_NULL, null=True, blank=True,
                                 verbose_name=_('article'))
 
+    objects = MacManager()
+
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['product', 'mac'], name='unique_product_mac_%(class)s'),
@@ -71,35 +223,168 @@ class Mac(models.Model):
         verbose_name_plural = _('MAC addresses')
 
     def __str__(self):
-        return str(netaddr.EUI(f'{self.product.oui}{int(self.product.mac_start, 16) + self.mac:0>6x}'))
+        return self.product.codec.mac(self.mac)
+
+
+class MacRangeManager(BaseMacManager):
+    def last_allocated(self, product):
+        last_mac = self.filter(product=product).aggregate(
+            last_mac=models.Max(models.F('start') + models.F('count') - 1, output_field=models.IntegerField()))
+        return last_mac['last_mac'] or 0
+
+    def free_blocks(self, product):
+        return self.filter(product=product, article__isnull=True, count=product.mac_quantity).count()
+
+    def find(self, product, mac):
+        """Range holding MAC offset ``mac``, found with one indexed range scan."""
+        mac_range = self.filter(product=product, start__lte=mac).order_by('-start').first()
+        if mac_range and mac < mac_range.start + mac_range.count:
+            return mac_range
+
+    def allocate(self, product, articles):
+        """
+        Assign one range of ``product.mac_quantity`` MACs to each of ``articles``.
+
+        Works like ``MacManager.allocate`` but stores one row per article.
+        """
+        quantity = product.mac_quantity
+        articles = list(articles)
+        if quantity == 0 or not articles:
+            return []
+
+        with transaction.atomic():
+            free = list(self.select_for_update(skip_locked=True).filter(
+                product=product, article__isnull=True, count=quantity).order_by('start')[:len(articles)])
+            for mac_range, article in zip(free, articles):
+                mac_range.article = article
+            self.bulk_update(free, ['article'])
+
+            rest = articles[len(free):]
+            if not rest:
+                return free
+
+            count = quantity * len(rest)
+            first_mac = Counter.objects.reserve(product, 'mac', count)
+            product.check_mac_range(first_mac - 1, count)
+            new = self.bulk_create([
+                MacRange(product=product, start=first_mac + i * quantity, count=quantity, article=article)
+                for i, article in enumerate(rest)
+            ])
+        return free + new
+
+
+class MacRange(models.Model):
+    product = models.ForeignKey('Product', on_delete=models.PROTECT, verbose_name=_('product'))
+    start = models.IntegerField(verbose_name=_('first MAC address'))
+    count = models.PositiveSmallIntegerField(verbose_name=_('MAC quantity'))
+    article = models.ForeignKey('Article', on_delete=models.SET_NULL, null=True, blank=True,
+                                verbose_name=_('article'))
+
+    objects = MacRangeManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'start'], name='unique_product_start_%(class)s'),
+        ]
+        verbose_name = _('MAC address range')
+        verbose_name_plural = _('MAC address ranges')
+
+    def __iter__(self):
+        return iter(range(self.start, self.start + self.count))
+
+    def __str__(self):
+        first, last = self.product.codec.macs((self.start, self.start + self.count - 1))
+        return f'{first} - {last}'
+
+
+class ArticleQuerySet(models.QuerySet):
+    def with_macs(self):
+        """
+        Load products and MACs of the configured storage with the articles.
+
+        MACs go to a plain list in ``prefetched_macs``: a prefetch into the
+        related manager builds a queryset per article, which costs more than
+        the query itself for a thousand articles.
+        """
+        return self.select_related('product').prefetch_related(models.Prefetch(
+            'macrange_set' if settings.MAC_STORAGE == 'range' else 'mac_set', to_attr='prefetched_macs'))
+
+    def merge_extra(self, patch):
+        """Merge ``patch`` into ``extra`` of all articles with one UPDATE that touches only ``extra``."""
+        fields = {'extra': JSONMerge('extra', patch), 'modified_at': timezone.now()}
+        if 'devices' in patch:
+            fields['activation_status'] = activation_status(patch)
+        return self.update(**fields)
+
+
+class ArticleManager(models.Manager.from_queryset(ArticleQuerySet)):
+    def allocate(self, product, barcodes, created_by):
+        """
+        Create articles for a whole production run in one transaction.
+
+        Serials are consecutive after the last serial of ``product``, MACs are
+        assigned in blocks of ``product.mac_quantity``. Articles and MACs are
+        written with bulk inserts, so ``Article.save()`` and ``add_mac`` are
+        not involved.
+        """
+        with transaction.atomic():
+            first_serial = Counter.objects.reserve(product, 'serial', len(barcodes))
+            product.check_serial_range(first_serial + len(barcodes) - 1)
+            articles = [
+                Article(product=product, serial=first_serial + i, barcode=barcode, created_by=created_by)
+                for i, barcode in enumerate(barcodes)
+            ]
+            articles = self.bulk_create(articles)
+            if articles and articles[0].pk is None:
+                # Backend can't return ids from bulk insert.
+                articles = list(self.filter(
+                    product=product, serial__range=(first_serial, first_serial + len(barcodes) - 1)).order_by('serial'))
+            mac_storage().allocate(product, articles)
+            ActivationCheck.objects.enroll(articles)
+        return articles
 
 
 class Article(models.Model):
     product = models.ForeignKey('Product', on_delete=models.PROTECT, verbose_name=_('product'))
-    serial = models.PositiveIntegerField(validators=[MaxValueValidator(999999)], verbose_name=_('serial number'))
+    serial = models.PositiveIntegerField(validators=[MaxValueValidator(SERIAL_MAX)], db_index=True,
+                                         verbose_name=_('serial number'))
     barcode = models.CharField(max_length=255, unique=True, verbose_name=_('barcode'))
     # imei = models.CharField(null=True, blank=True, max_length=255, unique=True, verbose_name=_('IMEI'))
 
-    success = models.BooleanField(null=True, verbose_name=_('success'))
+    success = models.BooleanField(null=True, db_index=True, verbose_name=_('success'))
 
     created_by = models.ForeignKey('accounts.User', on_delete=models.PROTECT, verbose_name=_('created by'))
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('created at'))
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name=_('created at'))
+    # Bulk updates of success, extra and activation status set it explicitly,
+    # products.stats.rollup recomputes the days of modified articles.
+    modified_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('modified at'))
 
     extra = models.JSONField(blank=True, default=dict, verbose_name=_('extra'))
+    # Copy of activation_status(extra) that can be indexed and filtered.
+    activation_status = models.BooleanField(null=True, editable=False, db_index=True,
+                                            verbose_name=_('activation status'))
+
+    objects = ArticleManager()
 
     @property
     def imei(self):
-        if self.product.body_identifier is None:
-            return
-        tac = '{}-{}{}'.format(self.product.body_identifier, self.product.mark, self.product.fac)
-        identity = '{}-{:0>6}'.format(tac, self.serial)
-        return f'{identity}-{luhn(identity)}'
+        return self.product.codec.imei(self.serial)
+
+    @property
+    def macs(self):
+        if settings.MAC_STORAGE == 'range':
+            mac_ranges = getattr(self, 'prefetched_macs', None)
+            if mac_ranges is None:
+                mac_ranges = self.macrange_set.all()
+            return self.product.codec.macs(mac for mac_range in mac_ranges for mac in mac_range)
+        macs = getattr(self, 'prefetched_macs', None)
+        if macs is None:
+            macs = self.mac_set.all()
+        return self.product.codec.macs(mac.mac for mac in macs)
 
     @property
     def serial_number(self):
-        if self.product.serial_mask:
-            return self.product.serial_mask.format(serial=self.serial)
-        return self.serial
+        return self.product.codec.serial_number(self.serial)
 
     class Meta:
         constraints = [
@@ -113,21 +398,27 @@ class Article(models.Model):
 
         # Validation MAC
         if self.pk is None:
-            mac = Mac.objects.filter(product=self.product).order_by('-mac').first()
-            if mac:
-                last_mac = netaddr.EUI(f'{self.product.oui}{int(self.product.mac_start, 16) + mac.mac:0>6x}')
-                if int(last_mac.ei.replace('-', ''), 16) >= int(self.product.mac_end, 16):
-                    params = {'product': self.product}
-                    raise ValidationError(_('Out of mac addresses for %(product)s'), code='max_value', params=params)
+            mac_storage().check_available(self.product)
 
     def save(self, force_insert=False, force_update=False, using=None,
              update_fields=None):
-        if self.pk is None and self.serial is None:
-            last_serial = Article.objects.all().aggregate(
-                serial__max=models.Max('serial', filter=models.Q(product=self.product)))
-            self.serial = (last_serial.get('serial__max', 0) or 0) + 1
-
-        super(Article, self).save(force_insert, force_update, using, update_fields)
+        self.activation_status = activation_status(self.extra)
+        if update_fields is not None:
+            update_fields = {*update_fields, 'modified_at'}
+            if 'extra' in update_fields:
+                update_fields.add('activation_status')
+
+        if self.pk is not None:
+            return super(Article, self).save(force_insert, force_update, using, update_fields)
+
+        # Keep the counter row locked until the article is inserted.
+        with transaction.atomic(using=using):
+            if self.serial is None:
+                self.serial = Counter.objects.reserve(self.product, 'serial')
+                self.product.check_serial_range(self.serial)
+            else:
+                Counter.objects.advance(self.product, 'serial', self.serial)
+            super(Article, self).save(force_insert, force_update, using, update_fields)
 
     # def get_absolute_url(self):
     #     return reverse('articles:detail', kwargs={'pk': self.pk})
@@ -139,29 +430,20 @@ class Article(models.Model):
 @receiver(models.signals.post_save, sender=Article)
 def add_mac(sender, instance, created, **kwargs):
     if created:
-        quantity = instance.product.mac_quantity
-        if quantity == 0:
-            return
+        mac_storage().allocate(instance.product, [instance])
 
-        if Mac.objects.filter(product=instance.product, article__isnull=True).count() >= quantity:
-            for mac in Mac.objects.filter(product=instance.product, article__isnull=True)[:quantity]:
-                mac.article = instance
-                mac.save()
 
-        else:
-            last_mac_object = Mac.objects.filter(product=instance.product).order_by('-mac').first()
-            last_mac = last_mac_object.mac if last_mac_object else 0
-
-            for i in range(1, quantity + 1):
-                new_mac = Mac(product=instance.product, mac=last_mac + i, article=instance)
-                new_mac.save()
+@receiver(models.signals.post_save, sender=Article)
+def add_activation_check(sender, instance, created, **kwargs):
+    if created:
+        ActivationCheck.objects.enroll([instance])
 
 
 class Operation(models.Model):
     article = models.ForeignKey('Article', on_delete=models.CASCADE, verbose_name=_('article'))
     type = models.PositiveSmallIntegerField(verbose_name=_('type'))
     responsible = models.CharField(max_length=255, verbose_name=_('responsible'))
-    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('created at'))
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name=_('created at'))
 
     class Meta:
         verbose_name = _('operation')
@@ -169,3 +451,378 @@ class Operation(models.Model):
 
     def __str__(self):
         return str(self.type)
+
+
+class ActivationCheckManager(models.Manager):
+    def enroll(self, articles, activated=False):
+        """Schedule the first activation check of ``articles`` of the products in ``ROS_PRODUCTS``."""
+        now = timezone.now()
+        return self.bulk_create([
+            ActivationCheck(article=article, next_check_at=now, activated=activated)
+            for article in articles if article.product_id in settings.ROS_PRODUCTS
+        ], ignore_conflicts=True)
+
+    def due(self, now=None):
+        """Checks that are due, found through the partial index on ``next_check_at``."""
+        return self.filter(activated=False, next_check_at__lte=now or timezone.now())
+
+
+class ActivationCheck(models.Model):
+    article = models.OneToOneField('Article', on_delete=models.CASCADE, primary_key=True,
+                                   related_name='activation_check', verbose_name=_('article'))
+    checked_at = models.DateTimeField(null=True, blank=True, verbose_name=_('last checked at'))
+    next_check_at = models.DateTimeField(verbose_name=_('next check at'))
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name=_('attempts'))
+    activated = models.BooleanField(default=False, verbose_name=_('activated'))
+
+    objects = ActivationCheckManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['next_check_at'], condition=models.Q(activated=False),
+                         name='activation_check_due_idx'),
+        ]
+        verbose_name = _('activation check')
+        verbose_name_plural = _('activation checks')
+
+    def __str__(self):
+        return str(self.article_id)
+
+    def record(self, devices, now):
+        """
+        Store the result of a check and schedule the next one.
+
+        Activation is terminal. Otherwise the interval doubles with every
+        attempt, from ``ROS_RECHECK_INTERVAL`` up to ``ROS_RECHECK_MAX_INTERVAL``.
+        """
+        self.checked_at = now
+        self.attempts += 1
+        self.activated = bool(activation_status({'devices': devices}))
+        interval = min(settings.ROS_RECHECK_INTERVAL * 2 ** (self.attempts - 1), settings.ROS_RECHECK_MAX_INTERVAL)
+        self.next_check_at = now + timedelta(seconds=interval)
+
+
+class RateLimitManager(models.Manager):
+    def reserve(self, name, duration):
+        """
+        Reserve ``duration`` seconds of the schedule of ``name`` and return their
+        start as a Unix timestamp, not earlier than now.
+
+        The row is locked with ``select_for_update`` like a ``Counter``, so
+        processes on all hosts share one schedule.
+        """
+        self.get_or_create(name=name)
+        with transaction.atomic():
+            limit = self.select_for_update().get(name=name)
+            start = max(limit.next_at, time.time())
+            limit.next_at = start + duration
+            limit.save(update_fields=['next_at'])
+        return start
+
+
+class RateLimit(models.Model):
+    name = models.CharField(max_length=64, primary_key=True, verbose_name=_('name'))
+    # Unix time at which the schedule is free again
+    next_at = models.FloatField(default=0, verbose_name=_('next start at'))
+
+    objects = RateLimitManager()
+
+    class Meta:
+        verbose_name = _('rate limit')
+        verbose_name_plural = _('rate limits')
+
+    def __str__(self):
+        return self.name
+
+
+class ActivationRunManager(models.Manager):
+    def start(self, article_ids, chunk_size):
+        """Create a run that checks ``article_ids`` in chunks of ``chunk_size``."""
+        article_ids = list(article_ids)
+        with transaction.atomic():
+            run = self.create(total=len(article_ids))
+            ActivationChunk.objects.bulk_create([
+                ActivationChunk(run=run, article_ids=article_ids[i:i + chunk_size])
+                for i in range(0, len(article_ids), chunk_size)
+            ])
+        return run
+
+
+class ActivationRun(models.Model):
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('created at'))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('finished at'))
+    total = models.PositiveIntegerField(verbose_name=_('total'))
+    processed = models.PositiveIntegerField(default=0, verbose_name=_('processed'))
+    # Articles of chunks given up, they stay due for the next run
+    failed = models.PositiveIntegerField(default=0, verbose_name=_('failed'))
+
+    objects = ActivationRunManager()
+
+    class Meta:
+        verbose_name = _('activation check run')
+        verbose_name_plural = _('activation check runs')
+
+    def __str__(self):
+        return str(self.created_at)
+
+    @property
+    def remaining(self):
+        return self.total - self.processed - self.failed
+
+    def abandon(self):
+        """Finish the run, giving up its unfinished chunks."""
+        for chunk in self.chunks.filter(finished_at__isnull=True):
+            chunk.finish(failed=True)
+
+    @property
+    def throughput(self):
+        """Articles per second since the run started."""
+        elapsed = ((self.finished_at or timezone.now()) - self.created_at).total_seconds()
+        return self.processed / elapsed if elapsed else 0
+
+
+class ActivationChunkManager(models.Manager):
+    def claim(self, pk, timeout, max_attempts):
+        """
+        Mark a chunk as started unless it is done or another worker started it
+        less than ``timeout`` seconds ago. Returns whether the chunk was claimed.
+
+        A chunk already started ``max_attempts`` times without finishing is
+        given up instead.
+        """
+        now = timezone.now()
+        claimable = self.filter(
+            models.Q(started_at__isnull=True) | models.Q(started_at__lt=now - timedelta(seconds=timeout)),
+            pk=pk, finished_at__isnull=True,
+        )
+        if claimable.filter(attempts__lt=max_attempts).update(started_at=now, attempts=models.F('attempts') + 1):
+            return True
+        chunk = claimable.first()
+        if chunk is not None:
+            chunk.finish(failed=True)
+        return False
+
+
+class ActivationChunk(models.Model):
+    run = models.ForeignKey('ActivationRun', on_delete=models.CASCADE, related_name='chunks', verbose_name=_('run'))
+    article_ids = models.JSONField(verbose_name=_('articles'))
+    started_at = models.DateTimeField(null=True, blank=True, verbose_name=_('started at'))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('finished at'))
+    attempts = models.PositiveSmallIntegerField(default=0, verbose_name=_('attempts'))
+    failed = models.BooleanField(default=False, verbose_name=_('failed'))
+
+    objects = ActivationChunkManager()
+
+    class Meta:
+        verbose_name = _('activation check chunk')
+        verbose_name_plural = _('activation check chunks')
+
+    def __str__(self):
+        return str(self.pk)
+
+    def finish(self, failed=False):
+        """Checkpoint the chunk and add it to the run progress, or to its failures if ``failed``."""
+        now = timezone.now()
+        with transaction.atomic():
+            unfinished = ActivationChunk.objects.filter(pk=self.pk, finished_at__isnull=True)
+            if not unfinished.update(finished_at=now, failed=failed):
+                return
+            self.finished_at = now
+            self.failed = failed
+            counter = 'failed' if failed else 'processed'
+            ActivationRun.objects.filter(pk=self.run_id).update(**{counter: models.F(counter) + len(self.article_ids)})
+            if not ActivationChunk.objects.filter(run_id=self.run_id, finished_at__isnull=True).exists():
+                ActivationRun.objects.filter(pk=self.run_id, finished_at__isnull=True).update(finished_at=now)
+
+
+class MediaFileManager(models.Manager):
+    def record(self, product_id, serial, stored):
+        """Index a file saved by the media storage, replacing the entry with the same name."""
+        article = Article.objects.filter(product_id=product_id, serial=serial).only('pk').first()
+        media_file, _created = self.update_or_create(product_id=product_id, serial=serial, name=stored.name, defaults={
+            'article': article,
+            'path': os.path.relpath(stored.path, settings.MEDIA_ROOT),
+            'size': stored.size,
+            'sha256': stored.sha256,
+        })
+        return media_file
+
+
+class MediaFile(models.Model):
+    article = models.ForeignKey('Article', on_delete=models.SET_NULL, null=True, blank=True, related_name='media',
+                                verbose_name=_('article'))
+    product = models.ForeignKey('Product', on_delete=models.PROTECT, verbose_name=_('product'))
+    serial = models.PositiveIntegerField(verbose_name=_('serial number'))
+    name = models.CharField(max_length=255, verbose_name=_('name'))
+    # Relative to MEDIA_ROOT
+    path = models.CharField(max_length=1024, verbose_name=_('path'))
+    size = models.PositiveBigIntegerField(verbose_name=_('size'))
+    sha256 = models.CharField(max_length=64, db_index=True, verbose_name=_('SHA-256'))
+    uploaded_at = models.DateTimeField(auto_now=True, verbose_name=_('uploaded at'))
+
+    objects = MediaFileManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['product', 'serial', 'name'], name='unique_product_ser_name_%(class)s'),
+        ]
+        verbose_name = _('media file')
+        verbose_name_plural = _('media files')
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def absolute_path(self):
+        return os.path.join(settings.MEDIA_ROOT, self.path)
+
+
+class UploadManager(models.Manager):
+    def open(self):
+        """Unfinished uploads that have not expired yet."""
+        return self.filter(finished_at__isnull=True, updated_at__gte=self._expiry())
+
+    def expired(self):
+        """Unfinished uploads without a chunk for ``MEDIA_UPLOAD_EXPIRY`` seconds."""
+        return self.filter(finished_at__isnull=True, updated_at__lt=self._expiry())
+
+    def _expiry(self):
+        return timezone.now() - timedelta(seconds=settings.MEDIA_UPLOAD_EXPIRY)
+
+    def remove_expired(self):
+        """Delete expired uploads with their partial files, returns how many."""
+        removed = 0
+        for upload in self.expired():
+            with transaction.atomic():
+                # A chunk may have arrived since the upload was listed
+                if not self.expired().filter(pk=upload.pk).select_for_update().exists():
+                    continue
+                path = upload.path
+                upload.delete()
+            try:
+                os.unlink(path)
+            except FileNotFoundError:
+                pass
+            removed += 1
+        return removed
+
+
+class Upload(models.Model):
+    """
+    Resumable upload of one large file for an article.
+
+    Chunks are written at their offset into a file preallocated to ``size``
+    bytes. ``received`` is the length of the prefix written so far, so a client
+    whose connection dropped asks for it and continues from there.
+    """
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, verbose_name=_('product'))
+    serial = models.PositiveIntegerField(validators=[MaxValueValidator(SERIAL_MAX)], verbose_name=_('serial number'))
+    name = models.CharField(max_length=255, verbose_name=_('name'))
+    size = models.PositiveBigIntegerField(verbose_name=_('size'))
+    received = models.PositiveBigIntegerField(default=0, verbose_name=_('received'))
+    sha256 = models.CharField(max_length=64, blank=True, verbose_name=_('SHA-256'))
+    created_by = models.ForeignKey('accounts.User', on_delete=models.PROTECT, verbose_name=_('created by'))
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name=_('created at'))
+    # Time of the last chunk, unfinished uploads expire after MEDIA_UPLOAD_EXPIRY without one
+    updated_at = models.DateTimeField(auto_now=True, db_index=True, verbose_name=_('updated at'))
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name=_('finished at'))
+
+    objects = UploadManager()
+
+    class Meta:
+        verbose_name = _('upload')
+        verbose_name_plural = _('uploads')
+
+    def __str__(self):
+        return self.name
+
+    @property
+    def path(self):
+        return os.path.join(settings.MEDIA_ROOT, 'uploads', f'{self.pk}.part')
+
+    def allocate(self):
+        """Create the partial file with all of its blocks reserved up front."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_WRONLY | os.O_CREAT, 0o644)
+        try:
+            try:
+                os.posix_fallocate(fd, 0, self.size)
+            except (AttributeError, OSError):
+                # Файловая система не умеет резервировать место, хватит и разреженного файла
+                os.ftruncate(fd, self.size)
+        finally:
+            os.close(fd)
+
+    def write(self, offset, stream, length, chunk_size=64 * 1024):
+        """
+        Write ``length`` bytes of ``stream`` at ``offset`` and move ``received``
+        forward. Rewriting bytes that were already received is allowed.
+        """
+        fd = os.open(self.path, os.O_WRONLY)
+        try:
+            position, end = offset, offset + length
+            while position < end:
+                data = stream.read(min(chunk_size, end - position))
+                if not data:
+                    break
+                data = memoryview(data)
+                while data:
+                    written = os.pwrite(fd, data, position)
+                    position += written
+                    data = data[written:]
+        finally:
+            os.close(fd)
+        Upload.objects.filter(pk=self.pk).update(received=Greatest('received', position), updated_at=timezone.now())
+        self.received = max(self.received, position)
+        return position
+
+
+class DailyArticleStats(models.Model):
+    """Articles of a product created on a day, rolled up by ``products.stats.rollup``."""
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, verbose_name=_('product'))
+    day = models.DateField(verbose_name=_('day'))
+    created = models.PositiveIntegerField(default=0, verbose_name=_('created'))
+    succeeded = models.PositiveIntegerField(default=0, verbose_name=_('succeeded'))
+    failed = models.PositiveIntegerField(default=0, verbose_name=_('failed'))
+    activated = models.PositiveIntegerField(default=0, verbose_name=_('activated'))
+    not_activated = models.PositiveIntegerField(default=0, verbose_name=_('not activated'))
+    computed_at = models.DateTimeField(null=True, verbose_name=_('computed at'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product'], name='unique_day_product_%(class)s'),
+        ]
+        verbose_name = _('daily article statistics')
+        verbose_name_plural = _('daily article statistics')
+
+    def __str__(self):
+        return f'{self.day} {self.product_id}'
+
+    @property
+    def pass_rate(self):
+        tested = self.succeeded + self.failed
+        return self.succeeded / tested if tested else None
+
+    @property
+    def activation_rate(self):
+        checked = self.activated + self.not_activated
+        return self.activated / checked if checked else None
+
+
+class DailyOperationStats(models.Model):
+    """Operations of a type on a product's articles on a day, rolled up by ``products.stats.rollup``."""
+    product = models.ForeignKey('Product', on_delete=models.CASCADE, verbose_name=_('product'))
+    day = models.DateField(verbose_name=_('day'))
+    type = models.PositiveSmallIntegerField(verbose_name=_('type'))
+    count = models.PositiveIntegerField(default=0, verbose_name=_('count'))
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'product', 'type'], name='unique_day_product_type_%(class)s'),
+        ]
+        verbose_name = _('daily operation statistics')
+        verbose_name_plural = _('daily operation statistics')
+
+    def __str__(self):
+        return f'{self.day} {self.product_id} {self.type}'
@@ -0,0 +1,69 @@
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+from rest_framework.pagination import PageNumberPagination, CursorPagination
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator that takes the row count of an unfiltered table from PostgreSQL
+    statistics instead of ``COUNT(*)``, which reads the whole table.
+
+    Filtered querysets, other databases and tables estimated below
+    ``threshold`` rows are counted exactly.
+    """
+    threshold = 100000
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        connection = connections[queryset.db]
+        if connection.vendor == 'postgresql' and not queryset.query.where:
+            with connection.cursor() as cursor:
+                cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass',
+                               [queryset.model._meta.db_table])
+                row = cursor.fetchone()
+            if row and row[0] >= self.threshold:
+                return row[0]
+        return super(EstimatedCountPaginator, self).count
+
+
+class IdCursorPagination(CursorPagination):
+    ordering = '-id'
+
+
+class PageNumberOrCursorPagination(PageNumberPagination):
+    """
+    Page number pagination, switched per request to keyset pagination on ``-id``.
+
+    Pass ``?pagination=cursor`` to get the first page and follow the ``next``
+    links after that. Cursor pages skip ``COUNT(*)`` and ``OFFSET``, so walking
+    the whole table costs the same for every page.
+    """
+    cursor_query_param = 'cursor'
+    pagination_query_param = 'pagination'
+    cursor_pagination_class = IdCursorPagination
+
+    cursor_paginator = None
+
+    def use_cursor(self, request):
+        return (request.query_params.get(self.pagination_query_param) == 'cursor' or
+                self.cursor_query_param in request.query_params)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.use_cursor(request):
+            self.cursor_paginator = self.cursor_pagination_class()
+            page = self.cursor_paginator.paginate_queryset(queryset, request, view)
+            self.display_page_controls = self.cursor_paginator.display_page_controls
+            return page
+        return super(PageNumberOrCursorPagination, self).paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super(PageNumberOrCursorPagination, self).get_paginated_response(data)
+
+    def to_html(self):
+        if self.cursor_paginator:
+            return self.cursor_paginator.to_html()
+        return super(PageNumberOrCursorPagination, self).to_html()
@@ -0,0 +1,203 @@
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+import json
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.utils import timezone
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.packages.urllib3.util.retry import Retry
+import requests
+
+from bsma.task_metrics import task_stats
+from .functions import JSONMerge
+from .models import Article, ActivationCheck, RateLimit, activation_status
+
+logger = logging.getLogger(__name__)
+
+ROS_URL = 'https://nottheapi.rosstat.cloud.rt.ru:8443/apiman-gateway/Byterg/getDeviceActivationStatus/1.0/{imei}'
+
+
+class RateLimiter:
+    """
+    Spaces request starts at least ``1 / rate`` seconds apart across all
+    threads and workers that use the same ``name``.
+
+    Start times are reserved for a whole batch at once in a ``RateLimit`` row,
+    so the limit costs one query per batch.
+    """
+
+    def __init__(self, rate, name='rosstat'):
+        self.interval = 1 / rate if rate else 0
+        self.name = name
+
+    def reserve(self, count):
+        """Start times of ``count`` requests as Unix timestamps."""
+        if not self.interval:
+            return [0] * count
+        first = RateLimit.objects.reserve(self.name, self.interval * count)
+        return [first + i * self.interval for i in range(count)]
+
+
+def wait_until(start):
+    delay = start - time.time()
+    if delay > 0:
+        time.sleep(delay)
+
+
+def make_session(concurrency, adapter=None):
+    """Session with a connection pool per worker thread and retries with exponential backoff."""
+    session = requests.Session()
+    session.auth = (settings.ROS_USER, settings.ROS_PASSWORD)
+    session.params = {'apikey': settings.ROS_API_KYE}
+    if adapter is None:
+        retry = Retry(total=settings.ROS_RETRIES, backoff_factor=settings.ROS_BACKOFF,
+                      status_forcelist=(429, 500, 502, 503, 504))
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency, max_retries=retry)
+    session.mount('https://', adapter)
+    return session
+
+
+class RosstatChecker:
+    """
+    Checks activation status of articles concurrently.
+
+    At most ``concurrency`` requests are in flight and at most ``rate``
+    requests are started per second by all checkers together, whichever
+    worker runs them. Results are written to
+    ``Article.extra['devices']`` and the next check is scheduled in
+    ``ActivationCheck``, with one ``bulk_update`` of each per batch.
+
+    Upstream latency, unusable answers and updated articles are counted
+    in ``stats``, the metrics of the running task by default.
+    """
+
+    def __init__(self, rate=None, concurrency=None, batch_size=None, adapter=None, stats=None):
+        self.rate = rate or settings.ROS_RATE
+        self.concurrency = concurrency or settings.ROS_CONCURRENCY
+        self.batch_size = batch_size or settings.ROS_BATCH_SIZE
+        self.limiter = RateLimiter(self.rate)
+        self.session = make_session(self.concurrency, adapter)
+
+        self.stats = stats if stats is not None else task_stats()
+        self.latency = self.stats.histogram('rosstat_request_duration_seconds',
+                                            'Activation API request time, retries included.',
+                                            buckets=(0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60))
+        self.errors = self.stats.counter('rosstat_errors_total', 'Activation checks without a usable answer.',
+                                         ['error'])
+        self.updated = self.stats.counter('rosstat_updated_total', 'Articles with an updated activation status.')
+
+    def fetch(self, article, start=0):
+        """
+        Devices reported for ``article``, ``None`` if the answer is unusable.
+        Waits until ``start``. Never raises, so one article can't fail the batch.
+        """
+        try:
+            return self._fetch(article, start)
+        except Exception as exc:
+            self.errors.inc(error=type(exc).__name__)
+            logger.exception('Activation check of %s failed', article.barcode)
+
+    def _fetch(self, article, start):
+        wait_until(start)
+        started = time.monotonic()
+        try:
+            r = self.session.get(ROS_URL.format(imei=article.imei.replace('-', '')), timeout=settings.ROS_TIMEOUT)
+        except requests.RequestException as exc:
+            self.latency.observe(time.monotonic() - started)
+            self.errors.inc(error=type(exc).__name__)
+            logger.warning('Activation check of %s failed: %s', article.barcode, exc)
+            return
+        self.latency.observe(time.monotonic() - started)
+
+        if r.headers.get('content-type') != 'application/json':
+            self.errors.inc(error=f'HTTP {r.status_code}' if r.status_code >= 400 else 'not JSON')
+            return
+
+        try:
+            data = r.json()
+        except json.JSONDecodeError:
+            self.errors.inc(error='invalid JSON')
+            return
+        if not isinstance(data, dict):
+            self.errors.inc(error='not an object')
+            return
+        return data.get('devices', [])
+
+    def run(self, articles):
+        """Check all ``articles`` and return the number of updated ones."""
+        articles = iter(articles)
+        updated = 0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while True:
+                batch = list(islice(articles, self.batch_size))
+                if not batch:
+                    return updated
+
+                checked = []
+                now = timezone.now()
+                for article, devices in zip(batch, executor.map(self.fetch, batch, self.limiter.reserve(len(batch)))):
+                    if devices is None:
+                        continue
+                    # Only 'devices' is written, keys set meanwhile by stations stay
+                    article.extra = JSONMerge('extra', {'devices': devices})
+                    article.activation_status = activation_status({'devices': devices})
+                    article.modified_at = now
+                    checked.append((article, devices))
+
+                Article.objects.bulk_update([article for article, _ in checked],
+                                            ['extra', 'activation_status', 'modified_at'])
+                self.schedule(checked)
+                self.updated.inc(len(checked))
+                updated += len(checked)
+
+    def schedule(self, checked):
+        now = timezone.now()
+        checks = ActivationCheck.objects.in_bulk([article.pk for article, _ in checked])
+        new = []
+        for article, devices in checked:
+            check = checks.get(article.pk)
+            if check is None:
+                check = ActivationCheck(article=article)
+                new.append(check)
+            check.record(devices, now)
+
+        ActivationCheck.objects.bulk_update(checks.values(), ['checked_at', 'next_check_at', 'attempts', 'activated'])
+        ActivationCheck.objects.bulk_create(new, ignore_conflicts=True)
+
+
+class FakeRosstatAdapter(BaseAdapter):
+    """
+    Offline transport that answers like the activation API after ``latency`` seconds.
+
+    Mount it with ``RosstatChecker(adapter=FakeRosstatAdapter())`` for tests
+    and benchmarks. ``activated`` decides the status for an IMEI.
+    """
+
+    def __init__(self, latency=0, activated=lambda imei: int(imei[-1]) % 2 == 0):
+        super(FakeRosstatAdapter, self).__init__()
+        self.latency = latency
+        self.activated = activated
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency)
+
+        imei = request.path_url.split('?')[0].rsplit('/', 1)[-1]
+        response = requests.Response()
+        response.status_code = 200
+        response.headers['content-type'] = 'application/json'
+        response._content = json.dumps({
+            'devices': [{'imei': imei, 'activation_status': self.activated(imei)}],
+        }).encode()
+        response.url = request.url
+        response.request = request
+        return response
+
+    def close(self):
+        pass
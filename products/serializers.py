@@ -1,10 +1,9 @@
 from rest_framework import serializers
 from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext_lazy as _
-from django.core.validators import ValidationError
-import netaddr
 
-from .models import Article, Operation, Mac
+from .models import (Product, Article, Operation, MediaFile, DailyArticleStats, DailyOperationStats,
+                     mac_storage)
 
 
 class WriteOnceMixin:
@@ -69,18 +68,66 @@ class OperationSerializer(serializers.ModelSerializer):
         fields = ['article', 'type', 'responsible', 'created_at']
 
 
+class OperationBatchItemSerializer(serializers.ModelSerializer):
+    article = serializers.CharField(max_length=255, label=_('Article'))
+    # Bounds of PositiveSmallIntegerField, bulk_create would fail the whole batch otherwise
+    type = serializers.IntegerField(min_value=0, max_value=32767, label=_('type'))
+
+    class Meta:
+        model = Operation
+        fields = ['article', 'type', 'responsible']
+
+
+class OperationBatchSerializer(serializers.Serializer):
+    max_operations = 1000
+
+    operations = OperationBatchItemSerializer(many=True, allow_empty=False, label=_('Operations'))
+
+    def validate_operations(self, value):
+        if len(value) > self.max_operations:
+            raise serializers.ValidationError(_('Ensure this field has no more than %(count)s elements.') % {
+                'count': self.max_operations})
+        return value
+
+    def save(self):
+        """
+        Insert operations of known articles with one barcode query and one bulk insert.
+        Operations of unknown barcodes are skipped and reported by their index.
+        """
+        operations = self.validated_data['operations']
+        articles = Article.objects.only('pk', 'barcode').in_bulk(
+            {operation['article'] for operation in operations}, field_name='barcode')
+
+        new, unknown = [], []
+        for index, operation in enumerate(operations):
+            article = articles.get(operation['article'])
+            if article is None:
+                unknown.append({'index': index, 'article': operation['article']})
+                continue
+            new.append(Operation(article=article, type=operation['type'], responsible=operation['responsible']))
+        Operation.objects.bulk_create(new)
+        return {'created': len(new), 'unknown': unknown}
+
+
+class MediaFileSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = MediaFile
+        fields = ['name', 'size', 'sha256', 'uploaded_at']
+
+
 class ArticleSerializer(WriteOnceMixin, serializers.ModelSerializer):
     # serial = serializers.IntegerField(required=False, read_only=True)
     serial = serializers.SerializerMethodField(required=False, read_only=True)
     imei = serializers.CharField(required=False, read_only=True)
-    mac = serializers.StringRelatedField(many=True, read_only=True, source='mac_set', required=False)
+    mac = serializers.ListField(child=serializers.CharField(), read_only=True, source='macs', required=False)
     success = serializers.NullBooleanField(required=False, label=_('Success'))
     operations = OperationSerializer(source='operation_set', many=True, read_only=True)
+    media = MediaFileSerializer(many=True, read_only=True)
     extra = serializers.JSONField(default=dict, initial=dict, required=False)
 
     class Meta:
         model = Article
-        fields = ['product', 'barcode', 'serial', 'imei', 'mac', 'success', 'operations', 'extra']
+        fields = ['product', 'barcode', 'serial', 'imei', 'mac', 'success', 'operations', 'media', 'extra']
         write_once_fields = ('barcode',)
 
     def get_serial(self, obj):
@@ -91,18 +138,100 @@ class ArticleSerializer(WriteOnceMixin, serializers.ModelSerializer):
             if 'extra' in validated_data:
                 extra = validated_data.pop('extra')
                 if isinstance(extra, dict):
-                    instance.extra.update(extra)
+                    # Merged in the database so concurrent patches of other keys are kept.
+                    Article.objects.filter(pk=instance.pk).merge_extra(extra)
+                    instance.refresh_from_db(fields=['extra', 'activation_status'])
+
+            # Write only the patched columns, a full save would overwrite extra again.
+            for attr, value in validated_data.items():
+                setattr(instance, attr, value)
+            if validated_data:
+                instance.save(update_fields=list(validated_data))
+            return instance
 
         return super(ArticleSerializer, self).update(instance, validated_data)
 
     def validate(self, attrs):
         if self.instance is None:
-            product = attrs['product']
-            mac = Mac.objects.filter(product=product).order_by('-mac').first()
-            if mac:
-                last_mac = netaddr.EUI(f'{product.oui}{int(product.mac_start, 16) + mac.mac:0>6x}')
-                if int(last_mac.ei.replace('-', ''), 16) >= int(product.mac_end, 16):
-                    params = {'product': product}
-                    raise ValidationError(_('Out of mac addresses for %(product)s'), code='max_value', params=params)
+            mac_storage().check_available(attrs['product'])
 
         return super(ArticleSerializer, self).validate(attrs)
+
+
+class ArticleAllocationSerializer(serializers.ModelSerializer):
+    serial = serializers.SerializerMethodField()
+    imei = serializers.CharField(read_only=True)
+    mac = serializers.ListField(child=serializers.CharField(), read_only=True, source='macs')
+
+    class Meta:
+        model = Article
+        fields = ['barcode', 'serial', 'imei', 'mac']
+
+    def get_serial(self, obj):
+        return obj.serial_number
+
+
+class ArticleBatchSerializer(serializers.Serializer):
+    product = serializers.PrimaryKeyRelatedField(queryset=Product.objects.all(), label=_('Product'))
+    barcodes = serializers.ListField(child=serializers.CharField(max_length=255), allow_empty=False,
+                                     max_length=1000, label=_('Barcodes'))
+
+    def validate_barcodes(self, value):
+        if len(set(value)) != len(value):
+            raise serializers.ValidationError(_('Barcodes must be unique.'))
+
+        existing = list(Article.objects.filter(barcode__in=value).values_list('barcode', flat=True))
+        if existing:
+            raise serializers.ValidationError(_('Articles already exist: %(barcodes)s') % {
+                'barcodes': ', '.join(existing)})
+        return value
+
+    def validate(self, attrs):
+        mac_storage().check_available(attrs['product'], len(attrs['barcodes']))
+        return super(ArticleBatchSerializer, self).validate(attrs)
+
+    def create(self, validated_data):
+        return Article.objects.allocate(**validated_data)
+
+
+class ArticleExtraBulkSerializer(serializers.Serializer):
+    barcodes = serializers.ListField(child=serializers.CharField(max_length=255), allow_empty=False,
+                                     label=_('Barcodes'))
+    extra = serializers.DictField(label=_('Extra'))
+
+    def validate_extra(self, value):
+        # JSON paths of SQLite can not address such keys, see JSONMerge
+        if any('"' in key for key in value):
+            raise serializers.ValidationError(_('Keys must not contain double quotes.'))
+        return value
+
+    def save(self):
+        barcodes = self.validated_data['barcodes']
+        articles = Article.objects.filter(barcode__in=barcodes)
+        updated = articles.merge_extra(self.validated_data['extra'])
+        unknown = []
+        if updated != len(set(barcodes)):
+            known = set(articles.values_list('barcode', flat=True))
+            unknown = [barcode for barcode in barcodes if barcode not in known]
+        return {'updated': updated, 'unknown': unknown}
+
+
+class ArticleLookupSerializer(serializers.Serializer):
+    identifiers = serializers.ListField(child=serializers.CharField(max_length=64), allow_empty=False,
+                                        max_length=1000, label=_('IMEI or MAC addresses'))
+
+
+class DailyArticleStatsSerializer(serializers.ModelSerializer):
+    pass_rate = serializers.FloatField(read_only=True)
+    activation_rate = serializers.FloatField(read_only=True)
+
+    class Meta:
+        model = DailyArticleStats
+        fields = ['product', 'day', 'created', 'succeeded', 'failed', 'pass_rate', 'activated', 'not_activated',
+                  'activation_rate']
+
+
+class DailyOperationStatsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DailyOperationStats
+        fields = ['product', 'day', 'type', 'count']
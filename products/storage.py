@@ -0,0 +1,173 @@
+from collections import namedtuple
+from functools import lru_cache
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.utils.module_loading import import_string
+
+StoredFile = namedtuple('StoredFile', ['name', 'path', 'size', 'sha256', 'created'])
+
+
+def file_digest(content):
+    """Size and SHA-256 of an uploaded file, read in chunks."""
+    sha256 = hashlib.sha256()
+    size = 0
+    for chunk in content.chunks():
+        sha256.update(chunk)
+        size += len(chunk)
+    return size, sha256.hexdigest()
+
+
+class LocalFile(File):
+    """File already on the media filesystem, moved into place by ``write_file`` instead of copied."""
+
+    def temporary_file_path(self):
+        return self.name
+
+
+def write_temporary(content, directory, digest=None):
+    """
+    Put an uploaded file into a new temporary file in ``directory`` and return
+    its path, size and SHA-256. The body is hashed while it is written; files
+    Django spooled to disk are moved and only hashed if ``digest`` is unknown.
+    """
+    os.makedirs(directory, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.upload-')
+    try:
+        with os.fdopen(fd, 'wb') as destination:
+            if hasattr(content, 'temporary_file_path'):
+                destination.close()
+                size, sha256 = digest or file_digest(content)
+                file_move_safe(content.temporary_file_path(), tmp_path, allow_overwrite=True)
+            else:
+                hasher = hashlib.sha256()
+                size = 0
+                for chunk in content.chunks():
+                    hasher.update(chunk)
+                    size += len(chunk)
+                    destination.write(chunk)
+                sha256 = hasher.hexdigest()
+        os.chmod(tmp_path, settings.FILE_UPLOAD_PERMISSIONS or 0o644)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    return tmp_path, size, sha256
+
+
+def write_file(content, path, digest=None):
+    """
+    Put an uploaded file at ``path`` through a temporary file in the same directory,
+    so ``path`` never holds a partial body. Returns its size and SHA-256.
+    """
+    tmp_path, size, sha256 = write_temporary(content, os.path.dirname(path), digest)
+    os.replace(tmp_path, path)
+    return size, sha256
+
+
+class DirectoryStorage:
+    """Keeps every file as ``MEDIA_ROOT/<product>/<serial>/<name>``."""
+
+    def __init__(self, root=None):
+        self.root = root or settings.MEDIA_ROOT
+
+    def article_path(self, product, serial):
+        return os.path.join(self.root, str(product), str(serial))
+
+    def path(self, product, serial, name):
+        return os.path.join(self.article_path(product, serial), name)
+
+    def save(self, product, serial, name, content, digest=None):
+        path = self.path(product, serial, name)
+        size, sha256 = write_file(content, path, digest)
+        return StoredFile(name, path, size, sha256, True)
+
+    def open(self, product, serial, name):
+        return open(self.path(product, serial, name), 'rb')
+
+    def stored(self, product, serial, exclude=()):
+        """Files already stored for an article, hashed from disk."""
+        article_path = self.article_path(product, serial)
+        for entry in os.scandir(article_path):
+            if entry.is_file() and not entry.name.startswith('.') and entry.name not in exclude:
+                with File(open(entry.path, 'rb')) as content:
+                    size, sha256 = file_digest(content)
+                yield StoredFile(entry.name, entry.path, size, sha256, False)
+
+
+class ContentAddressedStorage(DirectoryStorage):
+    """
+    Keeps every distinct file body once as ``MEDIA_ROOT/blobs/<sha256>``.
+
+    ``MEDIA_ROOT/<product>/<serial>/manifest.json`` maps the names uploaded
+    for an article to the hashes of their bodies. A body that is already
+    stored is not written again, only the manifest changes.
+
+    Files of the ``DirectoryStorage`` layout that are not in the manifest are
+    still found in the article directory, so switching storages needs no
+    conversion.
+    """
+    manifest_name = 'manifest.json'
+
+    def blob_path(self, sha256):
+        return os.path.join(self.root, 'blobs', sha256[:2], sha256[2:4], sha256)
+
+    def manifest_path(self, product, serial):
+        return os.path.join(self.article_path(product, serial), self.manifest_name)
+
+    def manifest(self, product, serial):
+        try:
+            with open(self.manifest_path(product, serial)) as manifest:
+                return json.load(manifest)
+        except FileNotFoundError:
+            return {}
+
+    def path(self, product, serial, name):
+        sha256 = self.manifest(product, serial).get(name)
+        if sha256 is None:
+            return super(ContentAddressedStorage, self).path(product, serial, name)
+        return self.blob_path(sha256)
+
+    def save(self, product, serial, name, content, digest=None):
+        tmp_path, size, sha256 = write_temporary(content, os.path.join(self.root, 'blobs'), digest)
+        path = self.blob_path(sha256)
+        created = not os.path.exists(path)
+        if created:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(tmp_path, path)
+        else:
+            os.unlink(tmp_path)
+        self.add_to_manifest(product, serial, {name: sha256})
+        return StoredFile(name, path, size, sha256, created)
+
+    def stored(self, product, serial):
+        manifest = self.manifest(product, serial)
+        for name, sha256 in manifest.items():
+            path = self.blob_path(sha256)
+            yield StoredFile(name, path, os.path.getsize(path), sha256, False)
+        yield from super(ContentAddressedStorage, self).stored(product, serial,
+                                                               exclude={self.manifest_name, *manifest})
+
+    def add_to_manifest(self, product, serial, entries):
+        article_path = self.article_path(product, serial)
+        os.makedirs(article_path, exist_ok=True)
+        # Concurrent uploads for the same article take turns on the manifest.
+        with open(os.path.join(article_path, '.manifest.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            manifest = self.manifest(product, serial)
+            manifest.update(entries)
+            fd, tmp_path = tempfile.mkstemp(dir=article_path, prefix='.manifest-')
+            with os.fdopen(fd, 'w') as tmp:
+                json.dump(manifest, tmp, ensure_ascii=False, indent=1)
+            os.replace(tmp_path, self.manifest_path(product, serial))
+
+
+@lru_cache(maxsize=None)
+def get_media_storage():
+    return import_string(settings.MEDIA_STORAGE)()
@@ -1,14 +1,21 @@
 # Create your tasks here
 from __future__ import absolute_import, unicode_literals
-import time
+from datetime import timedelta
+import logging
 
-from django.db.models import Q
 from django.conf import settings
+from django.utils import timezone
 from celery.schedules import crontab
-import requests
 
 from bsma.celery import app
-from .models import Article
+from bsma.task_metrics import task_stats
+from .models import Article, ActivationCheck, ActivationRun, ActivationChunk, Upload
+from .rosstat import RosstatChecker
+from .stats import rollup
+
+logger = logging.getLogger(__name__)
+
+CHUNK_TIME_LIMIT = 60 * 60
 
 
 @app.on_after_finalize.connect
@@ -17,25 +24,70 @@ def setup_periodic_tasks(sender, **kwargs):
         crontab(minute=5, hour=0),
         check_rosstat,
     )
+    sender.add_periodic_task(
+        crontab(minute='*/15'),
+        rollup_stats,
+    )
+    sender.add_periodic_task(
+        crontab(minute=30),
+        remove_expired_uploads,
+    )
 
 
-@app.task(time_limit=60*60*24, ignore_result=True)
+@app.task(ignore_result=True)
 def check_rosstat():
-    articles = Article.objects.filter(Q(product_id=1) & (Q(extra__isnull=True) | Q(extra__devices=[]))).order_by(
-        '-created_at')
-    for i, article in enumerate(articles, 1):
-        imei = article.imei.replace('-', '')
-        url = f'https://nottheapi.rosstat.cloud.rt.ru:8443/apiman-gateway/Byterg/getDeviceActivationStatus/1.0/{imei}'
-        r = requests.get(url, auth=(settings.ROS_USER, settings.ROS_PASSWORD), params={'apikey': settings.ROS_API_KYE})
-        time.sleep(1)
-
-        if r.headers['content-type'] != 'application/json':
-            continue
-
-        # if isinstance(article.extra, dict):
-        article.extra['devices'] = r.json().get('devices', [])
-        # elif article.extra is None:
-        #     article.extra = {
-        #         'devices': r.json()['devices'],
-        #     }
-        article.save()
+    """
+    Split articles with a due ``ActivationCheck`` into chunks and fan them out to the workers.
+
+    An unfinished run is resumed instead: only its chunks that have not been
+    checkpointed are dispatched again. Runs older than ``ROS_RUN_MAX_AGE`` are
+    given up, their unchecked articles are still due and go to a new run.
+    """
+    stale = timezone.now() - timedelta(seconds=settings.ROS_RUN_MAX_AGE)
+    for run in ActivationRun.objects.filter(finished_at__isnull=True, created_at__lt=stale):
+        logger.warning('Giving up activation check run %s: %s of %s processed', run.pk, run.processed, run.total)
+        run.abandon()
+
+    run = ActivationRun.objects.filter(finished_at__isnull=True).order_by('-pk').first()
+    if run is None:
+        article_ids = ActivationCheck.objects.due().order_by('next_check_at').values_list('article_id', flat=True)
+        run = ActivationRun.objects.start(article_ids.iterator(), settings.ROS_CHUNK_SIZE)
+        if not run.total:
+            ActivationRun.objects.filter(pk=run.pk).update(finished_at=run.created_at)
+            return
+    else:
+        logger.info('Resuming activation check run %s: %s of %s processed', run.pk, run.processed, run.total)
+
+    for chunk_id in run.chunks.filter(finished_at__isnull=True).values_list('pk', flat=True):
+        check_rosstat_chunk.delay(chunk_id)
+
+
+@app.task(time_limit=CHUNK_TIME_LIMIT, ignore_result=True)
+def check_rosstat_chunk(chunk_id):
+    if not ActivationChunk.objects.claim(chunk_id, timeout=CHUNK_TIME_LIMIT,
+                                         max_attempts=settings.ROS_CHUNK_MAX_ATTEMPTS):
+        return
+
+    chunk = ActivationChunk.objects.get(pk=chunk_id)
+    articles = Article.objects.filter(pk__in=chunk.article_ids).select_related('product')
+    RosstatChecker().run(articles.iterator())
+    chunk.finish()
+    task_stats().add_items(len(chunk.article_ids))
+
+    run = ActivationRun.objects.get(pk=chunk.run_id)
+    logger.info('Activation check run %s: %s processed, %s remaining, %.1f articles/s',
+                run.pk, run.processed, run.remaining, run.throughput)
+
+
+@app.task(ignore_result=True)
+def rollup_stats():
+    """Refresh daily statistics of the last ``STATS_ROLLUP_DAYS`` days."""
+    rollup(settings.STATS_ROLLUP_DAYS)
+
+
+@app.task(ignore_result=True)
+def remove_expired_uploads():
+    """Delete unfinished uploads without a chunk for ``MEDIA_UPLOAD_EXPIRY`` seconds and their partial files."""
+    removed = Upload.objects.remove_expired()
+    if removed:
+        logger.info('Removed %s expired uploads', removed)
@@ -1,4 +1,10 @@
+import hashlib
+
 from django import template
+from django.conf import settings
+from django.contrib.admin.templatetags.admin_list import date_hierarchy
+from django.contrib.admin.templatetags.base import InclusionAdminNode
+from django.core.cache import cache
 
 register = template.Library()
 
@@ -16,3 +22,23 @@ def field_name(value, field):
 
 
 register.filter('field_name', field_name)
+
+
+def cached_date_hierarchy(cl):
+    """
+    Admin ``date_hierarchy`` cached per model and changelist query string, so
+    the MIN/MAX and DISTINCT date queries over the table run once per timeout.
+    """
+    query = f'{cl.model._meta.label}{cl.get_query_string()}'
+    key = 'admin-date-hierarchy:' + hashlib.md5(query.encode()).hexdigest()
+    return cache.get_or_set(key, lambda: date_hierarchy(cl), settings.ADMIN_DATE_HIERARCHY_CACHE_TIMEOUT)
+
+
+@register.tag(name='cached_date_hierarchy')
+def cached_date_hierarchy_tag(parser, token):
+    return InclusionAdminNode(
+        parser, token,
+        func=cached_date_hierarchy,
+        template_name='date_hierarchy.html',
+        takes_context=False,
+    )
@@ -1,3 +1,799 @@
-from django.test import TestCase
+import base64
+import csv
+from datetime import timedelta
+import hashlib
+import io
+import json
+import os
+import shutil
+import tempfile
+import time
+from unittest import mock
+import zipfile
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from bsma.metrics import Registry
+from .codec import luhn
+from .export import stream_csv, stream_ndjson
+from .models import (Product, Article, Operation, Counter, Mac, MacRange, ActivationRun, ActivationChunk,
+                     DailyArticleStats, Upload, SERIAL_MAX, activation_status, mac_storage)
+from .rosstat import RosstatChecker, RateLimiter, FakeRosstatAdapter
+from .pagination import IdCursorPagination
+from .stats import rollup
+from .storage import ContentAddressedStorage, DirectoryStorage, file_digest, get_media_storage
+from .tasks import check_rosstat, check_rosstat_chunk
+from .views import ArticleFilterSet, station_authenticate
 
 # Create your tests here.
+
+
+class ArticleViewSetTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name='product', serial_mask='BT{serial:0>6}', body_identifier='35',
+                                              mark='1234', fac='56', mac_quantity=2, oui='a0b1c2',
+                                              mac_start='000000', mac_end='ffffff')
+
+    def create_articles(self, count):
+        start = Article.objects.count()
+        barcodes = [f'barcode-{i}' for i in range(start, start + count)]
+        articles = Article.objects.allocate(self.product, barcodes, self.user)
+        Operation.objects.bulk_create([
+            Operation(article=article, type=1, responsible='station') for article in articles for _ in range(2)
+        ])
+
+    def list_queries(self):
+        with CaptureQueriesContext(connection) as context:
+            response = self.client.get('/api/articles/')
+        self.assertEqual(response.status_code, 200)
+        return len(context.captured_queries)
+
+    def test_list_query_count_does_not_grow_with_page_size(self):
+        self.create_articles(1)
+        queries = self.list_queries()
+
+        self.create_articles(20)
+        self.assertEqual(self.list_queries(), queries)
+
+    def walk_cursor_pages(self, url):
+        """Results of all pages of ``url`` from the ``next`` links, and the SQL of all requests."""
+        results, queries = [], []
+        url = f'{url}?pagination=cursor'
+        with mock.patch.object(IdCursorPagination, 'page_size', 2):
+            while url:
+                with CaptureQueriesContext(connection) as context:
+                    response = self.client.get(url)
+                self.assertEqual(response.status_code, 200)
+                queries += [query['sql'].upper() for query in context.captured_queries]
+                results += response.json()['results']
+                url = response.json()['next']
+        return results, queries
+
+    def test_cursor_pagination_walks_both_viewsets(self):
+        self.create_articles(5)
+
+        articles, queries = self.walk_cursor_pages('/api/articles/')
+        self.assertEqual([article['barcode'] for article in articles],
+                         list(Article.objects.order_by('-id').values_list('barcode', flat=True)))
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql or 'OFFSET' in sql])
+
+        operations, queries = self.walk_cursor_pages('/api/operations/')
+        self.assertEqual(len(operations), Operation.objects.count())
+        self.assertFalse([sql for sql in queries if 'COUNT(' in sql or 'OFFSET' in sql])
+
+    def test_operation_batch_rejects_type_out_of_range(self):
+        self.create_articles(1)
+        operations = [{'article': 'barcode-0', 'type': type_, 'responsible': 'station'} for type_ in (1, 40000, -1)]
+
+        response = self.client.post('/api/operations/batch/', {'operations': operations}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        errors = response.json()['operations']
+        self.assertEqual(errors[0], {})
+        self.assertIn('type', errors[1])
+        self.assertIn('type', errors[2])
+        self.assertEqual(Operation.objects.count(), 2)
+
+
+@override_settings(ROS_USER='user', ROS_PASSWORD='password', ROS_API_KYE='key')
+class RosstatCheckerTest(TestCase):
+    def test_run_updates_extra_in_batches(self):
+        user = User.objects.create_user('station@example.com')
+        product = Product.objects.create(name='product', body_identifier='35', mark='1234', fac='56')
+        Article.objects.allocate(product, [f'barcode-{i}' for i in range(10)], user)
+        adapter = FakeRosstatAdapter()
+        checker = RosstatChecker(rate=1000, concurrency=4, batch_size=3, adapter=adapter)
+
+        updated = checker.run(Article.objects.select_related('product').iterator())
+
+        self.assertEqual(updated, 10)
+        self.assertEqual(adapter.requests, 10)
+        for article in Article.objects.select_related('product'):
+            imei = article.imei.replace('-', '')
+            self.assertEqual(article.extra['devices'], [{'imei': imei, 'activation_status': int(imei[-1]) % 2 == 0}])
+
+
+    def test_run_keeps_other_extra_keys(self):
+        user = User.objects.create_user('station@example.com')
+        product = Product.objects.create(name='product', body_identifier='35', mark='1234', fac='56')
+        Article.objects.allocate(product, ['barcode'], user)
+        articles = list(Article.objects.select_related('product'))
+        # Станция дописала свои данные, пока шла проверка
+        Article.objects.all().merge_extra({'station': 'test'})
+
+        checker = RosstatChecker(rate=1000, concurrency=1, batch_size=10, adapter=FakeRosstatAdapter())
+        self.assertEqual(checker.run(articles), 1)
+
+        article = Article.objects.get()
+        self.assertEqual(article.extra['station'], 'test')
+        self.assertEqual(len(article.extra['devices']), 1)
+        self.assertEqual(article.activation_status, article.extra['devices'][0]['activation_status'])
+
+
+    def test_rate_is_shared_by_checkers(self):
+        # Каждый чанк создает свой RosstatChecker, расписание у них общее
+        first, second = RateLimiter(rate=2), RateLimiter(rate=2)
+        now = time.time()
+
+        starts = first.reserve(3) + second.reserve(2) + first.reserve(1)
+
+        self.assertAlmostEqual(starts[0], now, delta=1)
+        for previous, start in zip(starts, starts[1:]):
+            self.assertAlmostEqual(start - previous, 0.5)
+
+
+    def test_unusable_answers_do_not_fail_the_batch(self):
+        user = User.objects.create_user('station@example.com')
+        product = Product.objects.create(name='product', body_identifier='35', mark='1234', fac='56')
+        Article.objects.allocate(product, [f'barcode-{i}' for i in range(4)], user)
+        articles = list(Article.objects.select_related('product').order_by('serial'))
+        bodies = dict(zip((article.imei.replace('-', '') for article in articles), (b'[]', b'null', b'"devices"')))
+
+        class BrokenAdapter(FakeRosstatAdapter):
+            def send(self, request, **kwargs):
+                response = super(BrokenAdapter, self).send(request, **kwargs)
+                response._content = bodies.get(request.path_url.split('?')[0].rsplit('/', 1)[-1], response._content)
+                return response
+
+        stats = Registry()
+        checker = RosstatChecker(rate=1000, concurrency=2, batch_size=10, adapter=BrokenAdapter(), stats=stats)
+
+        self.assertEqual(checker.run(articles), 1)
+        self.assertEqual(stats.dump()['rosstat_errors_total']['values'], [[['not an object'], 3]])
+        self.assertEqual(Article.objects.filter(extra__has_key='devices').get(), articles[-1])
+
+
+class ActivationStatusTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name='product')
+        self.article = Article.objects.create(product=self.product, barcode='barcode', created_by=self.user)
+
+    def test_malformed_extra_is_unknown(self):
+        for extra in (None, [1, 2], 'abc', {}, {'devices': 'abc'}, {'devices': []}, {'devices': ['x']},
+                      {'devices': [{'activation_status': 'yes'}]}, {'devices': [{'activation_status': 1}]}):
+            self.assertIsNone(activation_status(extra), extra)
+        self.assertIs(activation_status({'devices': [{'activation_status': False}]}), False)
+
+    def test_bulk_extra_rejects_quoted_keys(self):
+        response = self.client.patch('/api/articles/extra/', {'barcodes': ['barcode'], 'extra': {'a"b': 1}},
+                                     format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('extra', response.data)
+
+    def test_api_accepts_malformed_extra(self):
+        url = f'/api/articles/{self.article.barcode}/'
+        for devices in (['x'], 'abc', [{'activation_status': 'yes'}]):
+            response = self.client.patch(url, {'extra': {'devices': devices}}, format='json')
+            self.assertEqual(response.status_code, 200, devices)
+            self.article.refresh_from_db()
+            self.assertEqual(self.article.extra['devices'], devices)
+            self.assertIsNone(self.article.activation_status)
+
+        response = self.client.put(url, {'product': self.product.pk, 'barcode': 'barcode', 'extra': [1, 2]},
+                                   format='json')
+        self.assertEqual(response.status_code, 200)
+        self.article.refresh_from_db()
+        self.assertEqual(self.article.extra, [1, 2])
+
+        response = self.client.patch('/api/articles/extra/', {'barcodes': ['barcode'], 'extra': {'devices': ['x']}},
+                                     format='json')
+        self.assertEqual(response.status_code, 200)
+        self.article.refresh_from_db()
+        self.assertIsNone(self.article.activation_status)
+
+
+class LookupTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name='product', body_identifier='35', mark='1234', fac='56',
+                                              mac_quantity=2, oui='a0b1c2', mac_start='000000', mac_end='ffffff')
+
+    def lookup(self, expected):
+        response = self.client.post('/api/articles/lookup/', {'identifiers': list(expected)}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), len(expected))
+        found = {item['identifier']: item['article'] and item['article']['barcode'] for item in response.data}
+        self.assertEqual(found, expected)
+
+    def lookup_limit(self):
+        articles = Article.objects.allocate(self.product, [f'barcode-{i}' for i in range(1000)], self.user)
+        articles = Article.objects.with_macs().filter(pk__in=[article.pk for article in articles])
+
+        self.lookup({article.imei: article.barcode for article in articles})
+
+        expected = {article.macs[-1]: article.barcode for article in articles[:999]}
+        expected[self.product.codec.macs([10 ** 6])[0]] = None
+        self.lookup(expected)
+
+    def test_lookup_limit_rows(self):
+        self.lookup_limit()
+
+    @override_settings(MAC_STORAGE='range')
+    def test_lookup_limit_ranges(self):
+        self.lookup_limit()
+
+
+@override_settings(ARTICLE_EXTRA_INDEXED_KEYS=['tags'])
+class ArticleExtraFilterTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        product = Product.objects.create(name='product')
+        for barcode, extra in (('scalar', {'tags': 'a'}), ('array', {'tags': ['a', 'b']}),
+                               ('object', {'tags': {'a': 1, 'b': 2}}), ('other', {'color': 'red'})):
+            Article.objects.create(product=product, barcode=barcode, extra=extra, created_by=self.user)
+
+    def filter_extra(self, extra):
+        response = self.client.get('/api/articles/', {'extra': json.dumps(extra)})
+        self.assertEqual(response.status_code, 200)
+        results = response.data['results'] if isinstance(response.data, dict) else response.data
+        return {article['barcode'] for article in results}
+
+    def test_values_match_exactly(self):
+        self.assertEqual(self.filter_extra({'tags': 'a'}), {'scalar'})
+        self.assertEqual(self.filter_extra({'tags': ['a', 'b']}), {'array'})
+        self.assertEqual(self.filter_extra({'tags': ['a']}), set())
+        self.assertEqual(self.filter_extra({'tags': {'a': 1, 'b': 2}}), {'object'})
+        self.assertEqual(self.filter_extra({'tags': {'a': 1}}), set())
+        self.assertEqual(self.filter_extra({'color': 'red'}), {'other'})
+
+
+class RollupTest(TestCase):
+    def test_rollup_recomputes_modified_older_days(self):
+        user = User.objects.create_user('station@example.com')
+        product = Product.objects.create(name='product')
+        article = Article.objects.create(product=product, barcode='barcode', created_by=user)
+        created_at = timezone.now() - timedelta(days=30)
+        Article.objects.filter(pk=article.pk).update(created_at=created_at)
+        rollup()
+        rollup(7)
+
+        Article.objects.filter(pk=article.pk).merge_extra({'devices': [{'activation_status': True}]})
+        rollup(7)
+
+        stats = DailyArticleStats.objects.get()
+        self.assertEqual(stats.day, timezone.localdate(created_at))
+        self.assertEqual((stats.created, stats.activated), (1, 1))
+
+
+class ActivationRunTest(TestCase):
+    def setUp(self):
+        user = User.objects.create_user('station@example.com')
+        product = Product.objects.create(name='product', body_identifier='35', mark='1234', fac='56')
+        with override_settings(ROS_PRODUCTS=[product.pk]):
+            self.articles = Article.objects.allocate(product, [f'barcode-{i}' for i in range(4)], user)
+
+    def test_chunk_is_given_up_after_max_attempts(self):
+        run = ActivationRun.objects.start([article.pk for article in self.articles], 2)
+        chunk = run.chunks.order_by('pk').first()
+        for _ in range(2):
+            self.assertTrue(ActivationChunk.objects.claim(chunk.pk, timeout=0, max_attempts=2))
+
+        self.assertFalse(ActivationChunk.objects.claim(chunk.pk, timeout=0, max_attempts=2))
+
+        chunk.refresh_from_db()
+        run.refresh_from_db()
+        self.assertTrue(chunk.failed)
+        self.assertIsNotNone(chunk.finished_at)
+        self.assertEqual((run.failed, run.remaining), (2, 2))
+
+        run.chunks.exclude(pk=chunk.pk).get().finish()
+        run.refresh_from_db()
+        self.assertIsNotNone(run.finished_at)
+
+    @override_settings(ROS_RUN_MAX_AGE=60 * 60)
+    def test_stale_run_is_replaced(self):
+        stale = ActivationRun.objects.start([self.articles[0].pk], 1000)
+        ActivationRun.objects.filter(pk=stale.pk).update(created_at=timezone.now() - timedelta(hours=2))
+
+        with mock.patch.object(check_rosstat_chunk, 'delay') as delay:
+            check_rosstat()
+
+        stale.refresh_from_db()
+        self.assertIsNotNone(stale.finished_at)
+        self.assertEqual(stale.failed, 1)
+        run = ActivationRun.objects.get(finished_at__isnull=True)
+        self.assertEqual(run.total, 4)
+        delay.assert_called_once_with(run.chunks.get().pk)
+
+
+class SerialLimitTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.product = Product.objects.create(name='product', body_identifier='35', mark='1234', fac='56')
+
+    def test_imei_past_six_digits(self):
+        codec = self.product.codec
+        for serial in (0, 999999, 1000000, 12345678):
+            identity = f'{codec.tac}-{serial:0>6}'
+            self.assertEqual(codec.imei(serial), f'{identity}-{luhn(identity)}')
+
+    def test_allocation_stops_at_serial_max(self):
+        Counter.objects.reserve(self.product, 'serial', SERIAL_MAX - 1)
+
+        response = self.client.post('/api/articles/batch/', {'product': self.product.pk,
+                                                              'barcodes': ['barcode-1', 'barcode-2']}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Article.objects.exists())
+        response = self.client.post('/api/articles/batch/', {'product': self.product.pk, 'barcodes': ['barcode-1']},
+                                    format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(Article.objects.get().serial, SERIAL_MAX)
+
+    def test_allocation_batch_size_is_limited(self):
+        barcodes = [f'barcode-{i}' for i in range(1001)]
+
+        response = self.client.post('/api/articles/batch/', {'product': self.product.pk, 'barcodes': barcodes},
+                                    format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('barcodes', response.json())
+        self.assertFalse(Article.objects.exists())
+
+    def test_product_without_mac_range(self):
+        article = Article.objects.create(product=self.product, barcode='barcode', serial=1, created_by=self.user)
+
+        self.assertIsNone(self.product.codec.mac(0))
+        self.assertEqual(article.macs, [])
+
+
+class UploadTest(TestCase):
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        self.settings_override = override_settings(MEDIA_ROOT=self.media_root, MEDIA_UPLOAD_MAX_OPEN=2)
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+        get_media_storage.cache_clear()
+        self.addCleanup(get_media_storage.cache_clear)
+
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='product')
+
+    def start(self, name):
+        return self.client.post('/articles/upload/start/', {'product': self.product.pk, 'serial': 1, 'name': name,
+                                                            'size': 10})
+
+    def test_open_uploads_are_limited(self):
+        self.assertEqual(self.start('a.bin').status_code, 201)
+        self.assertEqual(self.start('b.bin').status_code, 201)
+        self.assertEqual(self.start('a.bin').status_code, 200)
+        self.assertEqual(self.start('c.bin').status_code, 429)
+
+        Upload.objects.filter(name='a.bin').update(updated_at=timezone.now() - timedelta(days=2))
+        self.assertEqual(self.start('c.bin').status_code, 201)
+
+    def test_expired_uploads_are_removed(self):
+        expired = Upload.objects.get(pk=self.start('a.bin').json()['id'])
+        active = Upload.objects.get(pk=self.start('b.bin').json()['id'])
+        Upload.objects.filter(pk=expired.pk).update(updated_at=timezone.now() - timedelta(days=2))
+
+        self.assertEqual(Upload.objects.remove_expired(), 1)
+
+        self.assertEqual(list(Upload.objects.all()), [active])
+        self.assertFalse(os.path.exists(expired.path))
+        self.assertTrue(os.path.exists(active.path))
+
+    def test_chunk_keeps_upload_open(self):
+        pk = self.start('a.bin').json()['id']
+        Upload.objects.filter(pk=pk).update(updated_at=timezone.now() - timedelta(days=2))
+
+        response = self.client.put(f'/articles/upload/{pk}/?offset=0', b'01234', content_type='application/octet-stream')
+
+        self.assertEqual(response.json()['received'], 5)
+        self.assertTrue(Upload.objects.open().filter(pk=pk).exists())
+        self.assertEqual(Upload.objects.remove_expired(), 0)
+
+    def upload(self, name, body=b'0123456789'):
+        pk = self.start(name).json()['id']
+        self.client.put(f'/articles/upload/{pk}/?offset=0', body, content_type='application/octet-stream')
+        return pk
+
+    def test_uploads_belong_to_their_creator(self):
+        pk = self.upload('a.bin')
+        other = User.objects.create_superuser('other@example.com', 'password')
+        self.client.force_login(other)
+
+        self.assertEqual(self.client.get(f'/articles/upload/{pk}/').status_code, 404)
+        self.assertEqual(self.client.post(f'/articles/upload/{pk}/finish/').status_code, 404)
+        response = self.start('a.bin')
+        self.assertEqual(response.status_code, 201)
+        self.assertNotEqual(response.json()['id'], pk)
+
+    def test_finish(self):
+        pk = self.upload('a.bin')
+
+        response = self.client.post(f'/articles/upload/{pk}/finish/',
+                                    {'sha256': hashlib.sha256(b'0123456789').hexdigest()})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['finished'])
+        with get_media_storage().open(self.product.pk, 1, 'a.bin') as f:
+            self.assertEqual(f.read(), b'0123456789')
+
+    def test_chunk_during_hashing_defers_finish(self):
+        pk = self.upload('a.bin')
+
+        def hash_while_chunk_arrives(content):
+            self.client.put(f'/articles/upload/{pk}/?offset=0', b'0', content_type='application/octet-stream')
+            return file_digest(content)
+
+        with mock.patch('products.views.file_digest', hash_while_chunk_arrives):
+            response = self.client.post(f'/articles/upload/{pk}/finish/',
+                                        {'sha256': hashlib.sha256(b'0123456789').hexdigest()})
+
+        self.assertEqual(response.status_code, 409)
+        self.assertFalse(response.json()['finished'])
+        self.assertEqual(response.json()['received'], 10)
+
+
+class ArticleExportTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.products = [
+            Product.objects.create(name='phone', serial_mask='PH{serial:0>6}', body_identifier='35', mark='1234',
+                                   fac='56', mac_quantity=1, oui='a0b1c2', mac_start='000000', mac_end='ffffff'),
+            Product.objects.create(name='box'),
+        ]
+        statuses = [True, False, None]
+        for product in self.products:
+            articles = Article.objects.allocate(product, [f'{product.name}-{i}' for i in range(5)], self.user)
+            for i, article in enumerate(articles):
+                Article.objects.filter(pk=article.pk).update(activation_status=statuses[i % 3],
+                                                             extra={'line': 'a' if i % 2 else 'b'})
+        self.articles = list(Article.objects.order_by('-id'))
+
+    def barcodes(self, rows):
+        return [row['barcode'] for row in rows]
+
+    def stream_rows(self, queryset, chunk_size):
+        ndjson = [json.loads(line) for line in ''.join(stream_ndjson(queryset, chunk_size)).splitlines()]
+        header, *rows = csv.reader(io.StringIO(''.join(stream_csv(queryset, chunk_size))))
+        return ndjson, [dict(zip(header, row)) for row in rows]
+
+    def test_streams_match_filters(self):
+        cases = [
+            ({}, lambda article: True),
+            ({'product': self.products[0].pk}, lambda article: article.product == self.products[0]),
+            ({'activation_status': 'true'}, lambda article: article.activation_status is True),
+            ({'activation_status': 'false'}, lambda article: article.activation_status is False),
+            ({'extra': '{"line": "a"}'}, lambda article: article.extra['line'] == 'a'),
+            ({'product': self.products[1].pk, 'activation_status': 'true'},
+             lambda article: article.product == self.products[1] and article.activation_status is True),
+        ]
+        for params, matches in cases:
+            with self.subTest(params=params):
+                expected = [article.barcode for article in self.articles if matches(article)]
+                queryset = ArticleFilterSet(params, Article.objects.all()).qs
+                whole_ndjson, whole_csv = self.stream_rows(queryset, 1000)
+                self.assertEqual(self.barcodes(whole_ndjson), expected)
+                self.assertEqual(self.barcodes(whole_csv), expected)
+                for chunk_size in (1, 2, 3):
+                    self.assertEqual(self.stream_rows(queryset, chunk_size), (whole_ndjson, whole_csv))
+
+                response = self.client.get('/api/articles/export/', dict(params, output='ndjson'))
+                self.assertEqual(response.status_code, 200)
+                rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+                self.assertEqual(rows, whole_ndjson)
+
+    def test_rows_are_formatted(self):
+        ndjson, csv_rows = self.stream_rows(Article.objects.filter(barcode='phone-0'), 2)
+        article = Article.objects.get(barcode='phone-0')
+
+        self.assertEqual(ndjson[0]['serial'], article.serial_number)
+        self.assertEqual(ndjson[0]['imei'], article.imei)
+        self.assertEqual(ndjson[0]['mac'], article.macs)
+        self.assertEqual(csv_rows[0]['mac'], ' '.join(article.macs))
+
+
+class MediaDownloadTest(TestCase):
+    bodies = {'photo.jpg': b'jpeg' * 10, 'log.txt': b'line\n' * (300 * 1024)}
+
+    def setUp(self):
+        self.media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.media_root)
+        get_media_storage.cache_clear()
+        self.addCleanup(get_media_storage.cache_clear)
+
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client.force_login(self.user)
+        self.product = Product.objects.create(name='product')
+        Article.objects.create(product=self.product, barcode='box', serial=1, created_by=self.user)
+
+    def download(self):
+        for name, body in self.bodies.items():
+            response = self.client.post('/articles/upload/', {'product': self.product.pk, 'serial': 1,
+                                                              'files': ContentFile(body, name=name)})
+            self.assertEqual(response.status_code, 200)
+
+        response = self.client.get('/api/articles/box/media/')
+
+        self.assertEqual(response.status_code, 200)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertIsNone(archive.testzip())
+        self.assertEqual({name: archive.read(name) for name in archive.namelist()},
+                         {f'box/{name}': body for name, body in self.bodies.items()})
+
+    def test_directory_storage(self):
+        with override_settings(MEDIA_ROOT=self.media_root, MEDIA_STORAGE='products.storage.DirectoryStorage'):
+            self.download()
+
+    def test_content_addressed_storage(self):
+        with override_settings(MEDIA_ROOT=self.media_root, MEDIA_STORAGE='products.storage.ContentAddressedStorage'):
+            self.download()
+
+
+class StationAuthenticateTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+        self.user = User.objects.create_user('station@example.com', 'password')
+
+    def station_authenticate(self, password='password'):
+        return station_authenticate(None, username='station@example.com', password=password)
+
+    def test_repeated_credentials_are_cached(self):
+        self.assertEqual(self.station_authenticate(), self.user)
+
+        with mock.patch('products.views.authenticate') as authenticate:
+            self.assertEqual(self.station_authenticate(), self.user)
+        authenticate.assert_not_called()
+
+    def test_password_change_invalidates_cache(self):
+        self.station_authenticate()
+        self.user.set_password('changed')
+        self.user.save()
+
+        self.assertIsNone(self.station_authenticate())
+        self.assertEqual(self.station_authenticate('changed'), self.user)
+
+    def test_deactivation_invalidates_cache(self):
+        self.station_authenticate()
+        User.objects.filter(pk=self.user.pk).update(is_active=False)
+
+        self.assertIsNone(self.station_authenticate())
+
+    def test_wrong_password_is_not_cached(self):
+        with mock.patch.object(cache, 'set') as cache_set:
+            self.assertIsNone(self.station_authenticate('wrong'))
+        cache_set.assert_not_called()
+
+    def test_basic_auth_sets_no_session_cookie(self):
+        credentials = base64.b64encode(b'station@example.com:password').decode()
+
+        response = self.client.post('/articles/upload/start/', HTTP_AUTHORIZATION=f'Basic {credentials}')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertNotIn(settings.SESSION_COOKIE_NAME, response.cookies)
+
+
+class ContentAddressedStorageTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.storage = ContentAddressedStorage(self.root)
+
+    def test_same_body_is_stored_once(self):
+        first = self.storage.save(1, 1, 'a.bin', ContentFile(b'body'))
+        second = self.storage.save(1, 2, 'b.bin', ContentFile(b'body'))
+
+        self.assertEqual((first.size, first.sha256), (4, hashlib.sha256(b'body').hexdigest()))
+        self.assertTrue(first.created)
+        self.assertFalse(second.created)
+        self.assertEqual(second.path, first.path)
+        self.assertEqual(os.listdir(os.path.join(self.root, 'blobs')), [first.sha256[:2]])
+
+    def test_legacy_files_are_found(self):
+        DirectoryStorage(self.root).save(1, 1, 'old.bin', ContentFile(b'old'))
+        self.storage.save(1, 1, 'new.bin', ContentFile(b'new'))
+
+        with self.storage.open(1, 1, 'old.bin') as f:
+            self.assertEqual(f.read(), b'old')
+        stored = {stored.name: stored.sha256 for stored in self.storage.stored(1, 1)}
+        self.assertEqual(stored, {'old.bin': hashlib.sha256(b'old').hexdigest(),
+                                  'new.bin': hashlib.sha256(b'new').hexdigest()})
+
+
+class SerialCounterTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('station@example.com')
+        self.product = Product.objects.create(name='product')
+
+    def create(self, barcode, serial=None):
+        return Article.objects.create(product=self.product, barcode=barcode, serial=serial, created_by=self.user)
+
+    def test_counter_is_seeded_from_existing_articles(self):
+        Article.objects.bulk_create([
+            Article(product=self.product, barcode=f'barcode-{serial}', serial=serial, created_by=self.user)
+            for serial in (3, 7)
+        ])
+        self.assertFalse(Counter.objects.exists())
+
+        articles = Article.objects.allocate(self.product, ['new-1', 'new-2'], self.user)
+
+        self.assertEqual([article.serial for article in articles], [8, 9])
+        self.assertEqual(Counter.objects.get(product=self.product).serial, 9)
+        self.assertEqual(self.create('new-3').serial, 10)
+
+    def test_explicit_serial_advances_counter(self):
+        self.assertEqual(self.create('first').serial, 1)
+        self.create('explicit', serial=50)
+        self.assertEqual(self.create('next').serial, 51)
+
+        self.create('lower', serial=20)
+        self.assertEqual(Counter.objects.get(product=self.product).serial, 51)
+        articles = Article.objects.allocate(self.product, ['batch'], self.user)
+        self.assertEqual(articles[0].serial, 52)
+
+
+class MacAllocationTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('station@example.com')
+        self.product = Product.objects.create(name='product', body_identifier='35', mark='1234', fac='56',
+                                              mac_quantity=2, oui='a0b1c2', mac_start='000010', mac_end='000014')
+
+    def allocate(self, *barcodes):
+        return Article.objects.allocate(self.product, barcodes, self.user)
+
+    def macs(self, article):
+        return sorted(Mac.objects.filter(article=article).values_list('mac', flat=True))
+
+    def test_free_blocks_are_reused(self):
+        first, second = self.allocate('first', 'second')
+        freed = self.macs(first)
+        first.delete()
+        self.assertEqual(Mac.objects.free_blocks(self.product), 1)
+
+        reused, = self.allocate('reused')
+
+        self.assertEqual(self.macs(reused), freed)
+        self.assertEqual(Counter.objects.get(product=self.product).mac, 4)
+        self.assertEqual(Mac.objects.free_blocks(self.product), 0)
+
+    def test_mac_end_is_inclusive(self):
+        articles = self.allocate('first', 'second')
+        # Offsets count from 1 after mac_start, the last block ends exactly at mac_end
+        self.assertEqual(articles[-1].macs[-1], 'A0-B1-C2-00-00-14')
+
+        with self.assertRaises(ValidationError):
+            Mac.objects.check_available(self.product)
+        with self.assertRaises(ValidationError):
+            self.allocate('third')
+        self.assertEqual(Article.objects.count(), 2)
+        self.assertEqual(Counter.objects.get(product=self.product).mac, 4)
+
+
+class FoldMacsTest(TestCase):
+    def test_ranges_match_rows(self):
+        user = User.objects.create_user('station@example.com')
+        product = Product.objects.create(name='product', body_identifier='35', mark='1234', fac='56', mac_quantity=3,
+                                         oui='a0b1c2', mac_start='000000', mac_end='ffffff')
+        Article.objects.allocate(product, [f'barcode-{i}' for i in range(10)], user)
+        Article.objects.filter(barcode__in=['barcode-2', 'barcode-3', 'barcode-7']).delete()
+        Article.objects.allocate(product, ['reused'], user)
+
+        def snapshot():
+            articles = Article.objects.with_macs().order_by('barcode')
+            return {article.barcode: article.macs for article in articles}, mac_storage().free_blocks(product)
+
+        rows = snapshot()
+        self.assertEqual(rows[1], 2)
+        call_command('fold_macs', stdout=io.StringIO())
+
+        self.assertFalse(Mac.objects.exists())
+        with override_settings(MAC_STORAGE='range'):
+            self.assertEqual(snapshot(), rows)
+
+            # Both free blocks are reused before new MACs are reserved
+            articles = Article.objects.allocate(product, ['next-1', 'next-2', 'next-3'], user)
+            self.assertEqual(MacRange.objects.free_blocks(product), 0)
+            self.assertEqual(articles[-1].macs, product.codec.macs([31, 32, 33]))
+
+
+class MetricsTest(TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.settings_override = override_settings(METRICS_TEXTFILE_DIR=self.directory, METRICS_TOKEN='token')
+        self.settings_override.enable()
+        self.addCleanup(self.settings_override.disable)
+
+        user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+
+    def scrape(self):
+        response = self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer token')
+        self.assertEqual(response.status_code, 200)
+        samples = {}
+        for line in response.content.decode().splitlines():
+            if line and not line.startswith('#'):
+                name, value = line.rsplit(' ', 1)
+                samples[name] = float(value)
+        return samples
+
+    def test_metrics_are_summed_over_workers(self):
+        sample = 'bsma_request_duration_seconds_count{view="article-list",method="GET",status="2xx"}'
+        before = self.scrape().get(sample, 0)
+        for _ in range(3):
+            self.assertEqual(self.client.get('/api/articles/').status_code, 200)
+        self.assertEqual(self.scrape()[sample], before + 3)
+
+        # Another gunicorn worker dumped its histograms as well
+        other = Registry()
+        other.histogram('bsma_request_duration_seconds', 'Time to build the response of a request.',
+                        ['view', 'method', 'status']).observe(0.1, view='article-list', method='GET', status='2xx')
+        with open(os.path.join(self.directory, '.process-999999.json'), 'w') as f:
+            json.dump(other.dump(), f)
+
+        self.assertEqual(self.scrape()[sample], before + 4)
+
+
+class ArticleAdminSearchTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_superuser('admin@example.com', 'password')
+        self.client.force_login(self.user)
+        product = Product.objects.create(name='product')
+        for barcode, serial in (('123456789012345678901234', 1), ('Box-7', 42)):
+            Article.objects.create(product=product, barcode=barcode, serial=serial, created_by=self.user)
+
+    def search(self, term):
+        response = self.client.get('/products/article/', {'q': term})
+        self.assertEqual(response.status_code, 200)
+        return response, {article.barcode for article in response.context['cl'].result_list}
+
+    def test_long_digit_barcode(self):
+        response, found = self.search('123456789012345678901234')
+        self.assertEqual(found, {'123456789012345678901234'})
+        self.assertContains(response, 'class="help"')
+
+    def test_serial_and_barcode_prefix(self):
+        self.assertEqual(self.search('42')[1], {'Box-7'})
+        self.assertEqual(self.search('Box')[1], {'Box-7'})
+        self.assertEqual(self.search('ox-7')[1], set())
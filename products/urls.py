@@ -7,6 +7,8 @@ from . import views
 router = routers.DefaultRouter()
 router.register(r'articles', views.ArticleViewSet)
 router.register(r'operations', views.OperationViewSet)
+router.register(r'stats/articles', views.DailyArticleStatsViewSet)
+router.register(r'stats/operations', views.DailyOperationStatsViewSet)
 
 
 articles_patterns = ([
@@ -15,7 +17,10 @@ articles_patterns = ([
     # path('<int:pk>/', views.ArticleDetailView.as_view(), name='detail'),
     # path('delete/<int:pk>/', views.ArticleDeleteView.as_view(), name='delete'),
     # path('next/', views.get_next, name='next'),
-    path('upload/', views.upload_media)
+    path('upload/', views.upload_media),
+    path('upload/start/', views.upload_start),
+    path('upload/<uuid:pk>/', views.upload_chunk),
+    path('upload/<uuid:pk>/finish/', views.upload_finish),
 ], 'articles')
 
 urlpatterns = [
@@ -1,24 +1,42 @@
 import base64
-import os
+import hashlib
+import hmac
 from functools import wraps
 import json
 
-from django.shortcuts import render, HttpResponseRedirect, HttpResponse
-from django.contrib.auth import authenticate, login
+from django.shortcuts import render, HttpResponseRedirect, HttpResponse, get_object_or_404
+from django.http import StreamingHttpResponse, JsonResponse
+from django.contrib.auth import authenticate, get_user_model
 from django.contrib.auth.mixins import LoginRequiredMixin
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse_lazy
+from django.utils.translation import gettext_lazy as _
 from django.views.generic import TemplateView, ListView, DetailView
 from django.views.generic.edit import CreateView, DeleteView
 from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST, require_http_methods
+from django.db import transaction
+from django.utils import timezone
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.core.files import File
 from django import forms
-from rest_framework import viewsets, mixins, permissions
+from rest_framework import viewsets, mixins, permissions, status, serializers
+from rest_framework.decorators import action
+from rest_framework.response import Response
 import django_filters
 
-from .models import Article, Operation
-from .serializers import ArticleSerializer, OperationSerializer
-from .forms import MediaForm
+from .models import Article, Operation, Upload, MediaFile, DailyArticleStats, DailyOperationStats
+from .serializers import (ArticleSerializer, OperationSerializer, ArticleBatchSerializer,
+                          ArticleAllocationSerializer, ArticleExtraBulkSerializer, ArticleLookupSerializer,
+                          OperationBatchSerializer, DailyArticleStatsSerializer, DailyOperationStatsSerializer)
+from .forms import MediaForm, UploadForm
+from .pagination import PageNumberOrCursorPagination
+from .export import STREAMS, CONTENT_TYPES, stream_zip, media_files
+from .indexes import indexed_extra_keys
+from .lookup import find_articles
+from .storage import get_media_storage, file_digest, LocalFile
 
 
 # Create your views here.
@@ -54,6 +72,30 @@ class ArticleDeleteView(LoginRequiredMixin, DeleteView):
     success_url = reverse_lazy('articles:list')
 
 
+def station_authenticate(request, username, password):
+    """
+    ``authenticate()`` that remembers verified credentials for ``STATION_AUTH_CACHE_TIMEOUT`` seconds.
+
+    The cache maps a keyed digest of the credentials to the user id and the
+    password hash they matched, so a repeated request costs one primary key
+    query instead of a password hash. Changing the password or deactivating
+    the user invalidates the entry.
+    """
+    key = 'station-auth:' + hmac.new(settings.SECRET_KEY.encode(), f'{username}:{password}'.encode(),
+                                     hashlib.sha256).hexdigest()
+    cached = cache.get(key)
+    if cached is not None:
+        user_id, password_hash = cached
+        user = get_user_model().objects.filter(pk=user_id, password=password_hash, is_active=True).first()
+        if user is not None:
+            return user
+
+    user = authenticate(request, username=username, password=password)
+    if user is not None:
+        cache.set(key, (user.pk, user.password), settings.STATION_AUTH_CACHE_TIMEOUT)
+    return user
+
+
 def http_basic_auth(func):
     @wraps(func)
     def _decorator(request, *args, **kwargs):
@@ -62,14 +104,20 @@ def http_basic_auth(func):
             if auth_method.lower() == 'basic':
                 auth = base64.b64decode(auth.strip()).decode()
                 username, password = auth.split(':', 1)
-                user = authenticate(request, username=username, password=password)
+                user = station_authenticate(request, username=username, password=password)
                 if user:
-                    login(request, user)
+                    # Stations do not keep cookies, a session would only be written and never read.
+                    request.user = user
         return func(request, *args, **kwargs)
 
     return _decorator
 
 
+def store_media(product_id, serial, name, content, digest=None):
+    stored = get_media_storage().save(product_id, serial, name, content, digest)
+    return MediaFile.objects.record(product_id, serial, stored)
+
+
 @csrf_exempt
 @http_basic_auth
 @login_required
@@ -78,29 +126,164 @@ def upload_media(request):
         form = MediaForm(request.POST, request.FILES)
         if form.is_valid():
             files = request.FILES.getlist('files')
-            path = os.path.join(settings.MEDIA_ROOT, request.POST["product"], request.POST["serial"])
-            if not os.path.exists(path):
-                os.makedirs(path)
             for f in files:
-                with open(os.path.join(path, f.name), 'wb+') as destination:
-                    for chunk in f.chunks():
-                        destination.write(chunk)
+                store_media(form.cleaned_data['product'].pk, form.cleaned_data['serial'], f.name, f)
             return HttpResponse(status=200)
         else:
             raise forms.ValidationError(f'{form}')
 
 
+def upload_state(upload):
+    return {
+        'id': upload.pk,
+        'name': upload.name,
+        'size': upload.size,
+        'received': upload.received,
+        'finished': upload.finished_at is not None,
+    }
+
+
+@csrf_exempt
+@http_basic_auth
+@login_required
+@require_POST
+def upload_start(request):
+    """
+    Start a resumable upload of ``name`` for product/serial, or return the
+    unfinished upload of the same file so the client continues from ``received``.
+    A user has at most ``MEDIA_UPLOAD_MAX_OPEN`` unfinished uploads.
+    """
+    form = UploadForm(request.POST)
+    if not form.is_valid():
+        return JsonResponse(form.errors, status=400)
+
+    upload = Upload.objects.open().filter(created_by=request.user, **form.cleaned_data).first()
+    if upload is not None:
+        return JsonResponse(upload_state(upload))
+    if Upload.objects.open().filter(created_by=request.user).count() >= settings.MEDIA_UPLOAD_MAX_OPEN:
+        return JsonResponse({'detail': 'too many unfinished uploads'}, status=429)
+
+    upload = Upload.objects.create(created_by=request.user, **form.cleaned_data)
+    upload.allocate()
+    return JsonResponse(upload_state(upload), status=201)
+
+
+@csrf_exempt
+@http_basic_auth
+@login_required
+@require_http_methods(['GET', 'PUT'])
+def upload_chunk(request, pk):
+    """
+    GET returns the upload state. PUT writes the request body at ``?offset=``,
+    which must not be past ``received``; otherwise 409 with the current state.
+    """
+    upload = get_object_or_404(Upload, pk=pk, created_by=request.user)
+    if request.method == 'PUT':
+        if upload.finished_at is not None:
+            return JsonResponse(upload_state(upload), status=409)
+        try:
+            offset = int(request.GET['offset'])
+            length = int(request.META['CONTENT_LENGTH'])
+        except (KeyError, ValueError):
+            return JsonResponse({'detail': 'offset and Content-Length are required'}, status=400)
+        if offset < 0 or length < 0 or offset + length > upload.size:
+            return JsonResponse({'detail': 'chunk is out of file bounds'}, status=400)
+        if offset > upload.received:
+            return JsonResponse(upload_state(upload), status=409)
+        upload.write(offset, request, length)
+    return JsonResponse(upload_state(upload))
+
+
+@csrf_exempt
+@http_basic_auth
+@login_required
+@require_POST
+def upload_finish(request, pk):
+    """
+    Check the ``sha256`` of the received file and move it to the media storage.
+    The file is hashed before the upload is locked; if a chunk arrived meanwhile
+    the answer is 409 and the client finishes again.
+    """
+    upload = get_object_or_404(Upload, pk=pk, created_by=request.user)
+    if upload.finished_at is not None:
+        return JsonResponse(upload_state(upload))
+    if upload.received < upload.size:
+        return JsonResponse(upload_state(upload), status=409)
+
+    try:
+        with open(upload.path, 'rb') as f:
+            size, sha256 = file_digest(File(f))
+    except FileNotFoundError:
+        # Загрузку уже завершил или удалил другой запрос
+        upload = get_object_or_404(Upload, pk=pk)
+        return JsonResponse(upload_state(upload), status=200 if upload.finished_at is not None else 409)
+
+    with transaction.atomic():
+        hashed_at = upload.updated_at
+        upload = get_object_or_404(Upload.objects.select_for_update(), pk=pk)
+        if upload.finished_at is not None:
+            return JsonResponse(upload_state(upload))
+        if upload.updated_at != hashed_at:
+            return JsonResponse(upload_state(upload), status=409)
+
+        if sha256 != request.POST.get('sha256', '').lower():
+            # Неизвестно, какой кусок испорчен, файл придется передать заново
+            Upload.objects.filter(pk=upload.pk).update(received=0)
+            upload.received = 0
+            return JsonResponse(dict(upload_state(upload), detail='checksum mismatch'), status=400)
+
+        with LocalFile(open(upload.path, 'rb'), upload.path) as f:
+            store_media(upload.product_id, upload.serial, upload.name, f, (size, sha256))
+
+        upload.sha256 = sha256
+        upload.finished_at = timezone.now()
+        upload.save(update_fields=['sha256', 'finished_at'])
+    return JsonResponse(upload_state(upload))
+
+
 class ArticleFilterSet(django_filters.FilterSet):
     extra = django_filters.CharFilter(field_name='extra', method='filter_extra')
 
     def filter_extra(self, queryset, name, _value):
+        """
+        ``?extra={"key": value, ...}`` matches articles whose ``extra[key]`` equals
+        each value exactly: ``{"tags": "a"}`` does not match ``{"tags": ["a"]}``.
+        """
         values = json.loads(_value)
-        query = {f'{name}__{key}': value for key, value in values.items()}
+        indexed = indexed_extra_keys(queryset.db)
+        query = {}
+        for key, value in values.items():
+            if key in indexed:
+                # Containment is what the GIN index serves, but it also matches
+                # arrays holding the value, so equality is checked on top of it.
+                query[f'{name}__{key}__contains'] = value
+            query[f'{name}__{key}'] = value
         return queryset.filter(**query)
 
     class Meta:
         model = Article
-        fields = ['product', 'serial', 'extra']
+        fields = ['product', 'serial', 'extra', 'activation_status']
+
+
+class DailyArticleStatsFilterSet(django_filters.FilterSet):
+    since = django_filters.DateFilter(field_name='day', lookup_expr='gte')
+    until = django_filters.DateFilter(field_name='day', lookup_expr='lte')
+
+    class Meta:
+        model = DailyArticleStats
+        fields = ['product', 'since', 'until']
+
+
+class DailyOperationStatsFilterSet(DailyArticleStatsFilterSet):
+    class Meta:
+        model = DailyOperationStats
+        fields = ['product', 'type', 'since', 'until']
+
+
+def zip_response(media, filename):
+    response = StreamingHttpResponse(stream_zip(media_files(media)), content_type='application/zip')
+    response['Content-Disposition'] = f'attachment; filename="{filename}.zip"'
+    return response
 
 
 # API ViewSets
@@ -112,17 +295,113 @@ class ArticleViewSet(mixins.CreateModelMixin,
     queryset = Article.objects.all().order_by('-id')
     serializer_class = ArticleSerializer
     permission_classes = (permissions.IsAdminUser,)
+    pagination_class = PageNumberOrCursorPagination
     lookup_field = 'barcode'
     filter_class = ArticleFilterSet
 
+    def get_queryset(self):
+        return super(ArticleViewSet, self).get_queryset().with_macs().prefetch_related('operation_set', 'media')
+
     def perform_create(self, serializer):
-        serializer.save(created_by=self.request.user)
+        try:
+            serializer.save(created_by=self.request.user)
+        except DjangoValidationError as exc:
+            # MAC or serial range ran out between validation and allocation.
+            raise serializers.ValidationError(exc.messages)
+
+    @action(detail=False, methods=['post'], serializer_class=ArticleBatchSerializer)
+    def batch(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        self.perform_create(serializer)
+        articles = serializer.instance
+
+        queryset = Article.objects.filter(pk__in=[article.pk for article in articles]).order_by('serial').with_macs()
+        return Response(ArticleAllocationSerializer(queryset, many=True).data, status=status.HTTP_201_CREATED)
+
+    @action(detail=False, methods=['patch'], url_path='extra', serializer_class=ArticleExtraBulkSerializer)
+    def bulk_extra(self, request):
+        """Merge one ``extra`` patch into all articles with the given barcodes in one statement."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save())
+
+    @action(detail=False, methods=['get', 'post'], serializer_class=ArticleLookupSerializer)
+    def lookup(self, request):
+        """
+        Find articles by IMEI or MAC, ``?id=`` may be repeated or POST ``identifiers``.
+        Unknown identifiers are answered with ``article: null``.
+        """
+        data = request.data if request.method == 'POST' else {'identifiers': request.query_params.getlist('id')}
+        serializer = self.get_serializer(data=data)
+        serializer.is_valid(raise_exception=True)
+
+        identifiers = serializer.validated_data['identifiers']
+        found = find_articles(identifiers)
+        # Each article is serialized once, even if several of its identifiers were asked for.
+        articles = list({article.pk: article for article in found.values() if article is not None}.values())
+        data = {article.pk: item for article, item in zip(articles, ArticleAllocationSerializer(articles, many=True).data)}
+        return Response([{
+            'identifier': identifier,
+            'article': data[found[identifier].pk] if found[identifier] else None,
+        } for identifier in identifiers])
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """Stream filtered articles as ``?output=csv`` (default) or ``?output=ndjson``."""
+        output = request.query_params.get('output', 'csv')
+        if output not in STREAMS:
+            raise serializers.ValidationError({'output': _('Unknown output %(output)s') % {'output': output}})
+
+        queryset = self.filter_queryset(self.queryset.all())
+        response = StreamingHttpResponse(STREAMS[output](queryset), content_type=CONTENT_TYPES[output])
+        response['Content-Disposition'] = f'attachment; filename="articles.{output}"'
+        return response
+
+    @action(detail=True, methods=['get'], url_path='media')
+    def media(self, request, barcode=None):
+        """Stream a zip of the article's media files."""
+        article = self.get_object()
+        return zip_response(MediaFile.objects.filter(article=article), article.barcode)
+
+    @action(detail=False, methods=['get'], url_path='media')
+    def media_bulk(self, request):
+        """Stream a zip of the media of filtered articles, ``?barcode=`` may be repeated."""
+        queryset = self.filter_queryset(self.queryset.all())
+        barcodes = request.query_params.getlist('barcode')
+        if barcodes:
+            queryset = queryset.filter(barcode__in=barcodes)
+        return zip_response(MediaFile.objects.filter(article__in=queryset), 'media')
 
 
 class OperationViewSet(mixins.CreateModelMixin,
                        mixins.RetrieveModelMixin,
                        mixins.ListModelMixin,
                        viewsets.GenericViewSet):
-    queryset = Operation.objects.all().order_by('-id')
+    queryset = Operation.objects.select_related('article').order_by('-id')
     serializer_class = OperationSerializer
     permission_classes = (permissions.IsAdminUser,)
+    pagination_class = PageNumberOrCursorPagination
+
+    @action(detail=False, methods=['post'], serializer_class=OperationBatchSerializer)
+    def batch(self, request):
+        """Create many operations in one request, see ``OperationBatchSerializer.save``."""
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(serializer.save(), status=status.HTTP_201_CREATED)
+
+
+class DailyArticleStatsViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Articles per product and day with pass and activation rates, see ``products.stats.rollup``."""
+    queryset = DailyArticleStats.objects.order_by('-day', 'product')
+    serializer_class = DailyArticleStatsSerializer
+    permission_classes = (permissions.IsAdminUser,)
+    filter_class = DailyArticleStatsFilterSet
+
+
+class DailyOperationStatsViewSet(mixins.ListModelMixin, viewsets.GenericViewSet):
+    """Operations per product, day and type, see ``products.stats.rollup``."""
+    queryset = DailyOperationStats.objects.order_by('-day', 'product', 'type')
+    serializer_class = DailyOperationStatsSerializer
+    permission_classes = (permissions.IsAdminUser,)
+    filter_class = DailyOperationStatsFilterSet